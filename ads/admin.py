@@ -1,4 +1,5 @@
 from django.contrib import admin
-from .models import ExchangeProposal
+from .models import Ad, ExchangeProposal
 # Register your models here.
+admin.site.register(Ad)
 admin.site.register(ExchangeProposal)
\ No newline at end of file
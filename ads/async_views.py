@@ -0,0 +1,170 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.shortcuts import redirect, render
+from rest_framework.exceptions import NotAuthenticated, NotFound, ValidationError
+from rest_framework.response import Response
+
+from .conditional import aads_stamp, list_etag, not_modified, object_etag, row_etag, set_validators
+from .events import event_stream, get_broker, user_channel
+from .fast_serializers import AD_PLAN, FastJSONRenderer
+from .models import Ad, AdFacet, ProposalCounter
+from .pagination import InvalidCursor, KeysetPagination, aget_page
+from .serializers import AdSerializer, parse_fields
+from .similar import asimilar_ads, get_index
+from .views import AdListQuery, AdViewSet, ProposalListQuery, api_ads_queryset, ordering_columns
+
+# Асинхронные версии читающих представлений для запуска под ASGI (uvicorn):
+# запросы к базе идут через асинхронный ORM, поток на запрос не занимается.
+# Подключаются настройкой ADS_ASYNC_VIEWS = True (см. ads/urls.py).
+
+
+async def ad_list(request):
+    request.user = await request.auser()
+    query = AdListQuery(request.GET)
+    etag = list_etag(request, await aads_stamp(), query.cursor_mode)
+    response = not_modified(request, etag)
+    if response is not None:
+        return set_validators(response, etag)
+
+    if query.cursor_mode:
+        try:
+            page_obj = await query.keyset_paginator().aget_page(query.cursor)
+        except InvalidCursor:
+            raise Http404('Неверный курсор')
+    else:
+        page_obj = await aget_page(query.paginator(), query.page_number)
+
+    categories = await AdFacet.objects.acategory_counts(query.condition)
+    condition_counts = await AdFacet.objects.acondition_counts(query.category)
+
+    response = render(request, 'ads/ad_list.html', query.context(page_obj, categories, condition_counts))
+    return set_validators(response, etag)
+
+
+async def ad_detail(request, pk):
+    request.user = await request.auser()
+    try:
+        ad = await Ad.objects.select_related('user__ad_counter').aget(pk=pk)
+    except Ad.DoesNotExist:
+        raise Http404('No Ad matches the given query.')
+    similar = get_index().lookup(ad.pk)
+    etag = object_etag(request, ad, similar, ad.author_ad_count)
+    response = not_modified(request, etag, ad.updated_at)
+    if response is None:
+        response = render(request, 'ads/ad_detail.html', {'ad': ad, 'similar_ads': await asimilar_ads(similar)})
+    return set_validators(response, etag, ad.updated_at)
+
+
+async def proposals_list(request, box='all'):
+    request.user = await request.auser()
+    if not request.user.is_authenticated:
+        return redirect('login')
+
+    query = ProposalListQuery(request.user, box, request.GET)
+    try:
+        page = await query.paginator.aget_page(query.cursor)
+    except InvalidCursor:
+        raise Http404('Invalid cursor')
+    counts = await ProposalCounter.objects.acounts(request.user)
+
+    return render(request, 'ads/proposals_list.html', query.context(page, counts))
+
+
+async def proposal_events(request):
+    # Server-Sent Events: создание предложений пользователя и смена их статуса.
+    # Соединение держится открытым, поэтому нужен ASGI-сервер
+    request.user = await request.auser()
+    if not request.user.is_authenticated:
+        return HttpResponseForbidden()
+    if not isinstance(request, ASGIRequest):
+        # Под WSGI StreamingHttpResponse дочитывает асинхронный поток до конца перед
+        # отправкой, а поток бесконечен: запрос занял бы поток сервера навсегда.
+        # 204 - EventSource больше не переподключается
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(
+        event_stream(
+            get_broker(), [user_channel(request.user.pk)],
+            heartbeat=getattr(settings, 'ADS_EVENTS_HEARTBEAT', 15),
+            retry=getattr(settings, 'ADS_EVENTS_RETRY', 5),
+        ),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # nginx не должен буферизовать поток
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# API: GET обрабатывается асинхронно, остальные методы, Basic-авторизация
+# и браузерное API передаются синхронному AdViewSet.
+sync_ad_list = AdViewSet.as_view({'get': 'list', 'post': 'create'})
+sync_ad_detail = AdViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+})
+
+
+def _needs_sync_api(request):
+    return (
+        request.method not in ('GET', 'HEAD')
+        or 'authorization' in request.headers
+        or 'format' in request.GET
+        or 'text/html' in request.headers.get('Accept', '')
+    )
+
+
+def _api_response(data, status=200, response=None):
+    response = response or Response(data, status=status)
+    response.accepted_renderer = FastJSONRenderer()
+    response.accepted_media_type = FastJSONRenderer.media_type
+    response.renderer_context = {}
+    return response
+
+
+async def ad_api_list(request):
+    if _needs_sync_api(request):
+        return await sync_to_async(sync_ad_list)(request)
+    request.user = await request.auser()
+    if not request.user.is_authenticated:
+        return _api_response({'detail': NotAuthenticated.default_detail}, status=403)
+
+    try:
+        fields = parse_fields(request.GET.get('fields'), AdSerializer.Meta.fields)
+    except ValidationError as exc:
+        return _api_response(exc.detail, status=400)
+    etag = list_etag(request, await aads_stamp(), FastJSONRenderer.media_type)
+    response = not_modified(request, etag)
+    if response is not None:
+        return set_validators(response, etag)
+    plan = AD_PLAN.subset(fields)
+    queryset = api_ads_queryset(request.GET)
+    pagination = KeysetPagination()
+    try:
+        page = await pagination.apaginate_queryset(plan.values(queryset, ordering_columns(queryset)), request)
+    except NotFound as exc:
+        return _api_response({'detail': exc.detail}, status=404)
+    response = pagination.get_paginated_response(plan.rows(page))
+    return set_validators(_api_response(None, response=response), etag)
+
+
+async def ad_api_detail(request, pk):
+    if _needs_sync_api(request):
+        return await sync_to_async(sync_ad_detail)(request, pk=pk)
+    request.user = await request.auser()
+    if not request.user.is_authenticated:
+        return _api_response({'detail': NotAuthenticated.default_detail}, status=403)
+    try:
+        fields = parse_fields(request.GET.get('fields'), AdSerializer.Meta.fields)
+    except ValidationError as exc:
+        return _api_response(exc.detail, status=400)
+    plan = AD_PLAN.subset(fields)
+    try:
+        row = await plan.values(Ad.objects.all(), ['id', 'updated_at']).aget(pk=pk)
+    except Ad.DoesNotExist:
+        return _api_response({'detail': 'No Ad matches the given query.'}, status=404)
+    etag = row_etag(request, Ad, row['id'], row['updated_at'], FastJSONRenderer.media_type)
+    response = not_modified(request, etag, row['updated_at'])
+    if response is None:
+        response = _api_response(plan.row(row))
+    return set_validators(response, etag, row['updated_at'])
@@ -0,0 +1,93 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+
+# Вход: пароль хэшируется один раз на попытку (AuthenticationForm.clean вызывает
+# authenticate(), представление берёт пользователя из формы). Неудачные попытки
+# считаются в кэше по паре (имя пользователя, IP) и по IP; после ADS_LOGIN_MAX_FAILURES
+# (ADS_LOGIN_MAX_FAILURES_PER_IP) за ADS_LOGIN_FAILURE_WINDOW секунд попытка
+# отклоняется до проверки пароля. Счётчик только по имени позволил бы любому
+# заблокировать чужую учётную запись, поэтому он привязан к адресу. Счётчики
+# живут в кэше по умолчанию: для нескольких процессов нужен общий кэш (Redis, Memcached).
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    # Число итераций из ADS_PASSWORD_ITERATIONS. Алгоритм тот же, что у Django,
+    # поэтому сохранённые хэши проверяются, а при входе пересчитываются
+    # с новым числом итераций (must_update)
+    @property
+    def iterations(self):
+        return getattr(settings, 'ADS_PASSWORD_ITERATIONS', hashers.PBKDF2PasswordHasher.iterations)
+
+
+def throttle_options():
+    return {
+        'max_failures': getattr(settings, 'ADS_LOGIN_MAX_FAILURES', 5),
+        'max_failures_per_ip': getattr(settings, 'ADS_LOGIN_MAX_FAILURES_PER_IP', 50),
+        'window': getattr(settings, 'ADS_LOGIN_FAILURE_WINDOW', 15 * 60),
+    }
+
+
+class LoginThrottle:
+    def __init__(self, max_failures=5, max_failures_per_ip=50, window=15 * 60):
+        self.max_failures = max_failures
+        self.max_failures_per_ip = max_failures_per_ip
+        self.window = window
+
+    def _keys(self, request, username):
+        # (ключ, предел); имя - без учёта регистра и вместе с адресом в виде хэша
+        # (ключ кэша без ограничений на символы)
+        keys = []
+        address = request.META.get('REMOTE_ADDR') if request is not None else None
+        if username:
+            digest = hashlib.sha256(('%s\0%s' % (username.lower(), address or '')).encode()).hexdigest()
+            keys.append(('login-failures:user:%s' % digest, self.max_failures))
+        if address:
+            keys.append(('login-failures:ip:%s' % address, self.max_failures_per_ip))
+        return keys
+
+    def blocked(self, request, username):
+        keys = self._keys(request, username)
+        counts = cache.get_many([key for key, _ in keys])
+        return any(counts.get(key, 0) >= limit for key, limit in keys)
+
+    def failed(self, request, username):
+        # Окно считается от первой неудачи
+        for key, _ in self._keys(request, username):
+            cache.add(key, 0, self.window)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Ключ истёк между add и incr
+                cache.set(key, 1, self.window)
+
+    def succeeded(self, request, username):
+        # Успешный вход сбрасывает счётчик имени с этого адреса; счётчик IP истекает сам
+        if username:
+            cache.delete(self._keys(request, username)[0][0])
+
+
+def get_login_throttle():
+    return LoginThrottle(**throttle_options())
+
+
+class ThrottledModelBackend(ModelBackend):
+    # Ограничение действует для всех путей входа: форма, админка, Basic-авторизация API
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        throttle = get_login_throttle()
+        if throttle.blocked(request, username):
+            # PermissionDenied останавливает перебор бэкендов, пароль не хэшируется
+            raise PermissionDenied
+        user = super().authenticate(request, username, password, **kwargs)
+        if user is not None:
+            throttle.succeeded(request, username)
+        elif password is not None:
+            throttle.failed(request, username)
+        return user
@@ -0,0 +1,221 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .models import Ad, AdFacet, ExchangeProposal, UserAdCounter, deferred_counters
+from .proposals import TRANSITIONS, TransitionError, change_status
+from .serializers import AdSerializer
+from .similar import schedule_refresh
+from .thumbnails import schedule_thumbnails
+
+# Пакетные изменения через API: все элементы проверяются заранее
+# (права - одним запросом), затем пакет применяется в одной транзакции
+# через bulk_create/bulk_update/delete. Если хотя бы один элемент не прошёл
+# проверку, ничего не записывается, а остальные элементы помечаются skipped.
+
+
+class BatchError(Exception):
+    # Ошибка пакета целиком (не список, превышен размер)
+    pass
+
+
+class BatchAborted(Exception):
+    # Элемент не удалось применить (apply уже отметил его ошибкой): пакет откатывается
+    pass
+
+
+class Batch:
+    def __init__(self, user, items):
+        max_size = getattr(settings, 'ADS_BATCH_MAX_SIZE', 100)
+        if not isinstance(items, list):
+            raise BatchError('Expected a list.')
+        if not items:
+            raise BatchError('Batch is empty.')
+        if len(items) > max_size:
+            raise BatchError('Batch is limited to %d items.' % max_size)
+        self.user = user
+        self.items = items
+        self.results = [None] * len(items)
+
+    @property
+    def failed(self):
+        return any(result is not None and 'errors' in result for result in self.results)
+
+    def fail(self, index, status, errors, pk=None):
+        self.results[index] = {'id': pk, 'status': status, 'errors': errors}
+
+    def ok(self, index, status, pk, data=None):
+        self.results[index] = {'id': pk, 'status': status}
+        if data is not None:
+            self.results[index]['data'] = data
+
+    def skip_valid(self):
+        for index, result in enumerate(self.results):
+            if result is None or 'errors' not in result:
+                self.results[index] = {'id': result and result['id'], 'status': 'skipped'}
+
+    def parse_ids(self, key='id'):
+        # {index: id} для элементов с корректным и неповторяющимся id
+        ids, seen = {}, set()
+        for index, item in enumerate(self.items):
+            pk = item.get(key) if isinstance(item, dict) else item
+            if isinstance(pk, bool) or not isinstance(pk, int):
+                self.fail(index, 'invalid', {key: ['A valid integer is required.']})
+            elif pk in seen:
+                self.fail(index, 'invalid', {key: ['Duplicate id in batch.']}, pk)
+            else:
+                seen.add(pk)
+                ids[index] = pk
+        return ids
+
+    def run(self):
+        self.validate()
+        if self.failed:
+            self.skip_valid()
+            return False
+        try:
+            with transaction.atomic():
+                self.apply()
+        except BatchAborted:
+            self.skip_valid()
+            return False
+        return True
+
+
+class AdBatch(Batch):
+    def report(self, status):
+        data = AdSerializer(list(self.ads.values()), many=True).data
+        for (index, ad), item in zip(self.ads.items(), data):
+            self.ok(index, status, ad.pk, item)
+
+
+class AdBatchCreate(AdBatch):
+    def validate(self):
+        serializer = AdSerializer()
+        self.ads = {}
+        for index, item in enumerate(self.items):
+            try:
+                validated = serializer.run_validation(item)
+            except ValidationError as exc:
+                self.fail(index, 'invalid', exc.detail)
+                continue
+            self.ads[index] = Ad(user=self.user, **validated)
+
+    def apply(self):
+        Ad.objects.bulk_create(self.ads.values())
+        # bulk_create не отправляет сигналы, поэтому фасеты обновляются здесь
+        AdFacet.objects.adjust(Counter(ad.facet_key for ad in self.ads.values()))
+        UserAdCounter.objects.adjust({(self.user.pk,): len(self.ads)})
+        schedule_refresh(ad.pk for ad in self.ads.values())
+        schedule_thumbnails(ad.image_url for ad in self.ads.values())
+        self.report('created')
+
+
+class AdOwnershipMixin:
+    forbidden_message = 'You can only edit your own ads.'
+
+    def owned_ads(self, ids, queryset):
+        # Один запрос на весь пакет: существование и владелец
+        ads = queryset.in_bulk(ids.values())
+        owned = {}
+        for index, pk in ids.items():
+            ad = ads.get(pk)
+            if ad is None:
+                self.fail(index, 'not_found', {'detail': 'Not found.'}, pk)
+            elif ad.user_id != self.user.pk:
+                self.fail(index, 'forbidden', {'detail': self.forbidden_message}, pk)
+            else:
+                owned[index] = ad
+        return owned
+
+
+class AdBatchUpdate(AdOwnershipMixin, AdBatch):
+    def validate(self):
+        ads = self.owned_ads(self.parse_ids(), Ad.objects.all())
+        serializer = AdSerializer(partial=True)
+        self.fields = {'version', 'updated_at'}
+        self.ads = {}
+        for index, ad in ads.items():
+            try:
+                validated = serializer.run_validation(self.items[index])
+            except ValidationError as exc:
+                self.fail(index, 'invalid', exc.detail, ad.pk)
+                continue
+            for name, value in validated.items():
+                setattr(ad, name, value)
+            self.fields.update(validated)
+            self.ads[index] = ad
+
+    def apply(self):
+        # bulk_update не вызывает save(): версия, время изменения и фасеты обновляются здесь
+        now = timezone.now()
+        deltas = Counter()
+        for ad in self.ads.values():
+            ad.version = F('version') + 1
+            ad.updated_at = now
+            deltas[ad._loaded_facet] -= 1
+            deltas[ad.facet_key] += 1
+        Ad.objects.bulk_update(self.ads.values(), sorted(self.fields))
+        for ad in self.ads.values():
+            # Версия увеличена в UPDATE (как в Ad.save) и в ответ не входит:
+            # поле становится отложенным и читается из базы при обращении
+            del ad.version
+        AdFacet.objects.adjust(deltas)
+        schedule_refresh(ad.pk for ad in self.ads.values())
+        schedule_thumbnails(ad.image_url for ad in self.ads.values())
+        self.report('updated')
+
+
+class AdBatchDelete(AdOwnershipMixin, AdBatch):
+    forbidden_message = 'You can only delete your own ads.'
+
+    def validate(self):
+        self.ads = self.owned_ads(self.parse_ids(), Ad.objects.only('id', 'user_id'))
+
+    def apply(self):
+        # Сигналы удаления срабатывают для каждого объявления, фасеты - одним пакетом
+        with deferred_counters():
+            Ad.objects.filter(pk__in=[ad.pk for ad in self.ads.values()]).delete()
+        for index, ad in self.ads.items():
+            self.ok(index, 'deleted', ad.pk)
+
+
+class ProposalBatchStatus(Batch):
+    # Статус меняет владелец объявления-получателя (как в update_proposal) или администратор.
+    # Переходы те же, что у одиночной смены (ads.proposals): решение окончательное,
+    # принятие отклоняет конкурирующие предложения
+    def validate(self):
+        ids = self.parse_ids()
+        proposals = ExchangeProposal.objects.only('id', 'status', 'receiver_user').in_bulk(ids.values())
+        statuses = dict(ExchangeProposal.STATUS_CHOICES)
+        self.proposals = {}
+        for index, pk in ids.items():
+            proposal = proposals.get(pk)
+            new_status = self.items[index].get('status') if isinstance(self.items[index], dict) else None
+            if proposal is None:
+                self.fail(index, 'not_found', {'detail': 'Not found.'}, pk)
+            elif proposal.receiver_user_id != self.user.pk and not self.user.is_staff:
+                self.fail(index, 'forbidden', {'detail': 'You do not have permission to update this proposal.'}, pk)
+            elif new_status not in statuses:
+                self.fail(index, 'invalid', {'status': ['"%s" is not a valid choice.' % new_status]}, pk)
+            elif new_status != proposal.status and new_status not in TRANSITIONS.get(proposal.status, ()):
+                self.conflict(index, TransitionError(proposal.status, new_status), pk)
+            else:
+                self.proposals[index] = (pk, new_status)
+
+    def conflict(self, index, exc, pk):
+        self.fail(index, 'conflict', {'status': [str(exc)]}, pk)
+
+    def apply(self):
+        # По порядку элементов: принятие может отклонить предложение, указанное в пакете дальше
+        for index, (pk, new_status) in self.proposals.items():
+            try:
+                proposal = change_status(pk, new_status).proposal
+            except TransitionError as exc:
+                self.conflict(index, exc, pk)
+                raise BatchAborted
+            self.ok(index, 'updated', proposal.pk, {'id': proposal.pk, 'status': proposal.status})
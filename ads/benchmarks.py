@@ -0,0 +1,259 @@
+import itertools
+import math
+import platform
+import random
+import time
+
+import django
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+
+from .auth import get_login_throttle
+from .fast_serializers import AD_PLAN, PROPOSAL_PLAN, FastJSONRenderer
+from .matching import DatabaseGraph, MemoryGraph, find_cycles
+from .models import Ad, DesireEdge, ExchangeProposal, User
+from .pagination import KeysetPaginator
+from .search import get_search_backend
+from .seeding import seed
+from .serializers import AdSerializer, ExchangeProposalSerializer
+
+# Набор замеров для основных представлений. Для каждого размера базы
+# данные генерируются заново, каждый сценарий выполняется repeat раз;
+# в отчёт попадают перцентили времени ответа и число SQL-запросов.
+# Запускается командой run_benchmarks, результат - JSON для сравнения прогонов.
+
+SUITES = {}
+
+
+def suite(name, seeded=True):
+    # seeded=False - набор строит данные сам, size для него имеет свой смысл
+    def register(func):
+        func.seeded = seeded
+        SUITES[name] = func
+        return func
+    return register
+
+
+def percentile(values, p):
+    # Перцентиль по методу ближайшего ранга
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(timings, queries=None):
+    result = {
+        'runs': len(timings),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p90_ms': round(percentile(timings, 90) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'max_ms': round(max(timings) * 1000, 3),
+        # Сценарии выполняются в одном потоке: это пропускная способность одного ядра
+        'ops_per_s': round(len(timings) / sum(timings), 1) if sum(timings) else None,
+    }
+    if queries is not None:
+        result['queries'] = percentile(queries, 50)
+    return result
+
+
+def measure(func, repeat):
+    timings, queries = [], []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        queries.append(len(ctx.captured_queries))
+    return summarize(timings, queries)
+
+
+def dataset_shape(size):
+    # size - число объявлений; пользователи и предложения пропорциональны ему
+    return {'users': max(10, size // 20), 'ads': size, 'proposals': size // 2}
+
+
+def reset_data():
+    # flush вместо delete(): без сигналов и каскадов по каждой строке
+    call_command('flush', interactive=False, verbosity=0)
+    get_search_backend().rebuild()
+    cache.clear()
+
+
+def _request(client, method, url, data=None, status=200):
+    def run():
+        response = getattr(client, method)(url, data or {})
+        if response.status_code != status:
+            raise AssertionError('%s %s: %s' % (method.upper(), url, response.status_code))
+    return run
+
+
+@suite('views')
+def view_scenarios(size):
+    client = Client()
+    # Получатель последнего предложения: у него есть и объявления, и предложения
+    user_id = ExchangeProposal.objects.order_by('-id').values_list('receiver_user', flat=True).first()
+    user = User.objects.get(pk=user_id) if user_id else User.objects.first()
+    client.force_login(user)
+    own_ad = Ad.objects.filter(user=user).first()
+    other_ad = Ad.objects.exclude(user=user).order_by('-created_at').first()
+    middle_ad = Ad.objects.order_by('-created_at', '-id')[size // 2]
+    category = Ad.objects.values_list('category', flat=True).first()
+    last_page = math.ceil(size / 10)
+    deep_cursor = KeysetPaginator(Ad.objects.order_by('-created_at'), 10).encode_cursor(middle_ad, reverse=False)
+    ad_list = reverse('ad_list')
+
+    return {
+        'ad_list': _request(client, 'get', ad_list),
+        'ad_list_search': _request(client, 'get', ad_list, {'search': 'велосипед'}),
+        'ad_list_filter': _request(client, 'get', ad_list, {'category': category, 'condition': 'new'}),
+        'ad_list_sort_title': _request(client, 'get', ad_list, {'sort': 'title'}),
+        'ad_list_deep_page': _request(client, 'get', ad_list, {'page': last_page}),
+        'ad_list_deep_cursor': _request(client, 'get', ad_list, {'cursor': deep_cursor}),
+        'ad_detail': _request(client, 'get', reverse('ad_detail', kwargs={'pk': other_ad.pk})),
+        'proposals_list': _request(client, 'get', reverse('proposals_list')),
+        'proposals_inbox': _request(client, 'get', reverse('proposals_inbox'), {'status': 'pending'}),
+        'create_exchange_proposal_form': _request(client, 'get', reverse('create_exchange_proposal')),
+        'create_exchange_proposal': _request(client, 'post', reverse('create_exchange_proposal'), {
+            'ad_sender': own_ad.pk, 'ad_receiver': other_ad.pk, 'comment': 'benchmark',
+        }, status=302),
+        'api_ads': _request(client, 'get', '/api/ads/', {'page_size': 20}),
+        'api_ads_search': _request(client, 'get', '/api/ads/', {'page_size': 20, 'search': 'велосипед'}),
+        'api_ad_detail': _request(client, 'get', '/api/ads/%d/' % other_ad.pk),
+        'api_proposals': _request(client, 'get', '/api/proposals/'),
+        'api_proposals_inbox': _request(client, 'get', '/api/proposals/inbox/', {'status': 'pending'}),
+        'api_proposal_counters': _request(client, 'get', '/api/proposals/counters/'),
+    }
+
+
+@suite('serializers')
+def serializer_scenarios(size, page_size=100):
+    # Сериализация страницы без HTTP: AdSerializer + JSONRenderer против values() + FieldPlan + FastJSONRenderer
+    ads = Ad.objects.order_by('-created_at')[:page_size]
+    proposals = ExchangeProposal.objects.order_by('-created_at')[:page_size]
+
+    # all() на каждом прогоне: без кэша результатов queryset
+    def drf(serializer_class, queryset):
+        return lambda: JSONRenderer().render(serializer_class(queryset.all(), many=True).data)
+
+    def fast(plan, queryset):
+        return lambda: FastJSONRenderer().render(plan.rows(plan.values(queryset.all())))
+
+    return {
+        'ads_drf': drf(AdSerializer, ads),
+        'ads_fast': fast(AD_PLAN, ads),
+        'proposals_drf': drf(ExchangeProposalSerializer, proposals),
+        'proposals_fast': fast(PROPOSAL_PLAN, proposals),
+    }
+
+
+@suite('matching', seeded=False)
+def matching_scenarios(size, degree=10, max_length=4):
+    # size - число рёбер графа желаний, средняя исходящая степень degree.
+    # Замеряется поиск цепочек через новое ребро: в памяти и по таблице DesireEdge
+    rng = random.Random(0)
+    nodes = max(2 * degree, size // degree)
+    graph = MemoryGraph()
+    while graph.edge_count < size:
+        graph.add_edge(rng.randrange(nodes), rng.randrange(nodes))
+
+    User.objects.bulk_create((User(username='graph_user_%d' % n) for n in range(nodes)), batch_size=5000)
+    user_ids = list(User.objects.filter(username__startswith='graph_user_').order_by('id').values_list('id', flat=True))
+    edges = graph.edges()
+    for start in range(0, len(edges), 5000):
+        DesireEdge.objects.bulk_create(
+            DesireEdge(from_user_id=user_ids[u], to_user_id=user_ids[v], proposal_count=1)
+            for u, v in edges[start:start + 5000]
+        )
+    database = DatabaseGraph()
+
+    def random_pair():
+        u, v = rng.sample(range(nodes), 2)
+        return u, v
+
+    def memory():
+        find_cycles(graph, *random_pair(), max_length=max_length)
+
+    def db():
+        u, v = random_pair()
+        find_cycles(database, user_ids[u], user_ids[v], max_length=max_length)
+
+    def db_add_edge():
+        # Путь из сигнала: счётчик ребра, проверка новизны, поиск и сохранение цепочек
+        u, v = random_pair()
+        DesireEdge.objects.adjust({(user_ids[u], user_ids[v]): 1})
+
+    return {
+        'find_cycles_memory': memory,
+        'find_cycles_db': db,
+        'add_edge_db': db_add_edge,
+    }
+
+
+@suite('auth', seeded=False)
+def auth_scenarios(size, password='benchmark-password'):
+    # size - число пользователей (не больше 1000). Вход через форму - один хэш на попытку;
+    # ops_per_s сценария login - входов в секунду на ядро
+    usernames = ['auth_user_%d' % n for n in range(max(1, min(size, 1000)))]
+    # Один хэш на всех: создание пользователей не должно занимать минуты
+    encoded = make_password(password)
+    User.objects.bulk_create(User(username=username, password=encoded) for username in usernames)
+    rotation = itertools.cycle(usernames)
+    client = Client()
+    throttle = get_login_throttle()
+    # Счётчик имени привязан к адресу: блокируется вход с адреса тестового клиента
+    blocked_request = RequestFactory().post(reverse('login'))
+    for _ in range(throttle.max_failures):
+        throttle.failed(blocked_request, 'auth_blocked')
+
+    def authenticate_once():
+        if authenticate(None, username=next(rotation), password=password) is None:
+            raise AssertionError('authenticate failed')
+
+    return {
+        'authenticate': authenticate_once,
+        'login': lambda: _request(client, 'post', reverse('login'), {
+            'username': next(rotation), 'password': password,
+        }, status=302)(),
+        'login_throttled': _request(client, 'post', reverse('login'), {
+            'username': 'auth_blocked', 'password': password,
+        }, status=429),
+    }
+
+
+def run(sizes, repeat=20, suites=None, scenarios=None, stdout=None):
+    results = []
+    suites = suites or list(SUITES)
+    for size in sizes:
+        reset_data()
+        if any(SUITES[name].seeded for name in suites):
+            start = time.perf_counter()
+            seed(**dataset_shape(size))
+            if stdout is not None:
+                stdout.write('size=%d: данные за %.1f с' % (size, time.perf_counter() - start))
+        for suite_name in suites:
+            for name, func in SUITES[suite_name](size).items():
+                if scenarios and name not in scenarios:
+                    continue
+                func()  # прогрев
+                results.append({'suite': suite_name, 'size': size, 'scenario': name, **measure(func, repeat)})
+                if stdout is not None:
+                    stdout.write('  %-32s p50=%8.2f ms  p99=%8.2f ms  queries=%d' % (
+                        name, results[-1]['p50_ms'], results[-1]['p99_ms'], results[-1]['queries']))
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'repeat': repeat,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'results': results,
+    }
@@ -0,0 +1,159 @@
+import csv
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from .models import Ad, AdFacet, UserAdCounter
+from .serializers import AdSerializer
+from .similar import schedule_refresh
+from .thumbnails import schedule_thumbnails
+
+# Массовая загрузка объявлений из NDJSON или CSV.
+# Поток читается построчно, строки проверяются и вставляются пачками
+# через bulk_create, весь импорт идёт в одной транзакции.
+
+FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'application/json-lines': 'ndjson',
+    'text/csv': 'csv',
+}
+
+
+def detect_format(content_type='', filename=''):
+    content_type = content_type.split(';')[0].strip().lower()
+    if content_type in CONTENT_TYPES:
+        return CONTENT_TYPES[content_type]
+    if filename.endswith('.csv'):
+        return 'csv'
+    if filename.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return None
+
+
+def decode_lines(stream, bad_lines):
+    # Строки потока (куски могут резать строки где угодно) в UTF-8. Неверная
+    # кодировка не прерывает импорт: номер строки и ошибка попадают в bad_lines,
+    # сама строка декодируется с заменой символов. Байт \n не встречается внутри
+    # многобайтных символов UTF-8, поэтому строки декодируются по отдельности
+    tail = b''
+    line_number = 0
+    for chunk in stream:
+        *lines, tail = (tail + chunk).split(b'\n')
+        for line in lines:
+            line_number += 1
+            yield decode_line(line + b'\n', line_number, bad_lines)
+    if tail:
+        yield decode_line(tail, line_number + 1, bad_lines)
+
+
+def decode_line(line, line_number, bad_lines):
+    try:
+        return line.decode('utf-8')
+    except UnicodeDecodeError as exc:
+        bad_lines[line_number] = {'non_field_errors': ['Invalid UTF-8: %s' % exc]}
+        return line.decode('utf-8', 'replace')
+
+
+def iter_ndjson(stream):
+    # (номер строки, словарь) или (номер строки, ошибка разбора)
+    bad_lines = {}
+    for line_number, line in enumerate(decode_lines(stream, bad_lines), start=1):
+        if line_number in bad_lines:
+            yield line_number, bad_lines[line_number], False
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_number, {'non_field_errors': ['Invalid JSON: %s' % exc]}, False
+            continue
+        if not isinstance(row, dict):
+            yield line_number, {'non_field_errors': ['Expected a JSON object.']}, False
+            continue
+        yield line_number, row, True
+
+
+def iter_csv(stream):
+    bad_lines = {}
+    reader = csv.DictReader(decode_lines(stream, bad_lines))
+    if reader.fieldnames is not None and bad_lines:
+        # Без заголовка строки не разобрать
+        yield min(bad_lines), bad_lines[min(bad_lines)], False
+        return
+    previous = reader.line_num
+    for row in reader:
+        # Номер строки файла с учётом заголовка. Запись CSV может занимать
+        # несколько строк: ошибка любой из них - ошибка записи
+        broken = [n for n in bad_lines if n > previous]
+        previous = reader.line_num
+        if broken:
+            yield reader.line_num, bad_lines[broken[0]], False
+        else:
+            yield reader.line_num, row, True
+
+
+def iter_rows(stream, fmt):
+    if fmt == 'csv':
+        return iter_csv(stream)
+    return iter_ndjson(stream)
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def add_error(self, row, errors):
+        self.errors.append({'row': row, 'errors': errors})
+
+    def as_dict(self):
+        return {'created': self.created, 'failed': len(self.errors), 'errors': self.errors}
+
+
+class AdImporter:
+    def __init__(self, user, batch_size=None):
+        self.user = user
+        self.batch_size = batch_size or getattr(settings, 'ADS_IMPORT_BATCH_SIZE', 500)
+        # Один экземпляр сериализатора на весь импорт: поля строятся один раз
+        self.serializer = AdSerializer()
+
+    def run(self, stream, fmt):
+        report = ImportReport()
+        batch = []
+        with transaction.atomic():
+            for line_number, row, parsed in iter_rows(stream, fmt):
+                if not parsed:
+                    report.add_error(line_number, row)
+                    continue
+                batch.append((line_number, row))
+                if len(batch) >= self.batch_size:
+                    self.flush(batch, report)
+                    batch = []
+            if batch:
+                self.flush(batch, report)
+        return report
+
+    def flush(self, batch, report):
+        ads = []
+        for line_number, row in batch:
+            try:
+                validated = self.serializer.run_validation(row)
+            except ValidationError as exc:
+                report.add_error(line_number, exc.detail)
+                continue
+            ads.append(Ad(user=self.user, **validated))
+        if not ads:
+            return
+        Ad.objects.bulk_create(ads, batch_size=self.batch_size)
+        # bulk_create не отправляет сигналы, поэтому фасеты обновляются здесь
+        AdFacet.objects.adjust(Counter(ad.facet_key for ad in ads))
+        UserAdCounter.objects.adjust({(self.user.pk,): len(ads)})
+        schedule_refresh(ad.pk for ad in ads)
+        schedule_thumbnails(ad.image_url for ad in ads)
+        report.created += len(ads)
@@ -0,0 +1,63 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+# Кэш отрисованных карточек объявлений для ad_list.
+# Ключ - id объявления, его версия и счётчики предложений: после сохранения Ad
+# версия растёт (счётчики меняются без save()), и старый фрагмент просто
+# перестаёт запрашиваться.
+# Кнопки владельца в подвале карточки в кэш не попадают.
+
+CARD_TEMPLATE = 'ads/_ad_card.html'
+# Увеличивать при изменении разметки карточки
+CARD_TEMPLATE_VERSION = 3
+CARD_TIMEOUT = 60 * 60 * 24
+HITS_KEY = 'ad_card:stats:hits'
+MISSES_KEY = 'ad_card:stats:misses'
+
+
+def card_key(ad):
+    # created_at защищает от повторного использования id после удаления (SQLite)
+    return 'ad_card:v%d:%d:%d:%d:%d:%d' % (
+        CARD_TEMPLATE_VERSION, ad.pk, ad.version, ad.created_at.timestamp() * 1000000,
+        ad.received_count, ad.pending_count,
+    )
+
+
+def render_cards(ads):
+    # Один get_many на страницу, отрисовываются только промахи
+    keys = [card_key(ad) for ad in ads]
+    cached = cache.get_many(keys)
+    missing = {}
+    cards = []
+    for ad, key in zip(ads, keys):
+        html = cached.get(key)
+        if html is None:
+            html = missing[key] = render_to_string(CARD_TEMPLATE, {'ad': ad})
+        cards.append((ad, mark_safe(html)))
+    if missing:
+        cache.set_many(missing, CARD_TIMEOUT)
+    _count(HITS_KEY, len(cached))
+    _count(MISSES_KEY, len(missing))
+    return cards
+
+
+def _count(key, amount):
+    if not amount:
+        return
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        if not cache.add(key, amount, None):
+            cache.incr(key, amount)
+
+
+def card_cache_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0}
+
+
+def reset_card_cache_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,70 @@
+import hashlib
+
+from django.db.models import Max, Subquery, Sum
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+
+from .models import Ad, AdFacet
+
+# Условные GET-запросы: ETag и Last-Modified для объявлений и списков.
+# Если у клиента актуальная версия, возвращается 304 без отрисовки шаблона
+# и без сериализации. ETag списка строится по времени последнего изменения
+# объявлений, их числу (чтобы учитывались удаления), параметрам запроса и пользователю.
+
+# Увеличивать при изменении шаблонов или формата ответов API
+ETAG_VERSION = 2
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(repr((ETAG_VERSION, *parts)).encode()).hexdigest())
+
+
+def _stamp_query():
+    # Один запрос: сумма фасетов и MAX(updated_at) по индексу ad_updated_idx
+    last = Ad.objects.order_by('-updated_at').values('updated_at')[:1]
+    return AdFacet.objects.all(), {'total': Sum('ad_count'), 'last': Max(Subquery(last))}
+
+
+def ads_stamp():
+    queryset, aggregates = _stamp_query()
+    stamp = queryset.aggregate(**aggregates)
+    return stamp['last'], stamp['total'] or 0
+
+
+async def aads_stamp():
+    queryset, aggregates = _stamp_query()
+    stamp = await queryset.aaggregate(**aggregates)
+    return stamp['last'], stamp['total'] or 0
+
+
+def row_etag(request, model, pk, updated_at, *parts):
+    return make_etag(
+        model._meta.label, pk, updated_at.isoformat(), request.user.pk, sorted(request.GET.lists()), *parts,
+    )
+
+
+def object_etag(request, obj, *parts):
+    return row_etag(request, type(obj), obj.pk, obj.updated_at, *parts)
+
+
+def list_etag(request, stamp, *parts):
+    last, total = stamp
+    return make_etag('list', last and last.isoformat(), total, request.user.pk, sorted(request.GET.lists()), *parts)
+
+
+def not_modified(request, etag, last_modified=None):
+    # HttpResponseNotModified, если If-None-Match/If-Modified-Since совпали, иначе None
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+
+
+def set_validators(response, etag, last_modified=None):
+    if response.status_code not in (200, 304):
+        return response
+    response.headers['ETag'] = etag
+    if last_modified:
+        response.headers['Last-Modified'] = http_date(last_modified.timestamp())
+    # Ответ зависит от пользователя: только кэш браузера и перепроверка при каждом запросе
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,153 @@
+import asyncio
+import itertools
+import json
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+# Уведомления о предложениях обмена для открытых страниц (Server-Sent Events).
+# Отправитель и получатель предложения подписаны на свой канал user:<id>;
+# при создании предложения и смене статуса событие публикуется после фиксации
+# транзакции. Брокер по умолчанию - в памяти процесса (один процесс ASGI-сервера);
+# для нескольких процессов подключается свой класс с тем же интерфейсом
+# (publish, subscribe) через ADS_EVENTS_BROKER.
+
+
+def events_enabled():
+    return getattr(settings, 'ADS_EVENTS_ENABLED', getattr(settings, 'ADS_ASYNC_VIEWS', False))
+
+
+def user_channel(user_id):
+    return 'user:%d' % user_id
+
+
+class Subscription:
+    # Очередь событий одного подключения; живёт в цикле событий подписчика
+    def __init__(self, broker, channels, maxsize):
+        self.broker = broker
+        self.channels = tuple(channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        # Очередь переполнилась (клиент не успевает читать): часть событий потеряна
+        self.overflowed = False
+
+    def deliver(self, message):
+        # Вызывается в цикле событий подписчика
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout=None):
+        # Следующее событие или None, если за timeout секунд ничего не пришло
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    # Публикация из любого потока (синхронные представления, on_commit),
+    # доставка - через call_soon_threadsafe в цикл событий подписчика
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels, self.queue_size)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def publish(self, channel, message):
+        # Число подписчиков, которым отправлено событие
+        message = dict(message, id=next(self._ids))
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # Цикл событий подписчика уже закрыт
+                self.unsubscribe(subscription)
+        return len(subscribers)
+
+
+_brokers = {}
+
+
+def get_broker():
+    path = getattr(settings, 'ADS_EVENTS_BROKER', 'ads.events.InProcessBroker')
+    if path not in _brokers:
+        _brokers[path] = import_string(path)()
+    return _brokers[path]
+
+
+def proposal_message(proposal, event):
+    return {
+        'event': event,
+        'proposal': {
+            'id': proposal.pk,
+            'status': proposal.status,
+            'ad_sender': proposal.ad_sender_id,
+            'ad_receiver': proposal.ad_receiver_id,
+            'sender_user': proposal.sender_user_id,
+            'receiver_user': proposal.receiver_user_id,
+            'updated_at': proposal.updated_at.isoformat() if proposal.updated_at else None,
+        },
+    }
+
+
+def publish_proposals(proposals, event):
+    # event: 'created' или 'status'; отправка после фиксации транзакции
+    messages = [
+        (user_channel(user_id), proposal_message(proposal, event))
+        for proposal in proposals
+        for user_id in {proposal.sender_user_id, proposal.receiver_user_id}
+    ]
+    if messages:
+        broker = get_broker()
+        transaction.on_commit(lambda: [broker.publish(channel, message) for channel, message in messages])
+
+
+def format_sse(message):
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (
+        message['id'], message['event'], json.dumps(message['proposal'], separators=(',', ':')),
+    )
+
+
+async def event_stream(broker, channels, heartbeat, retry):
+    # Тело ответа text/event-stream; комментарий-пульс держит соединение через прокси.
+    # Подписка - при начале передачи, отписка - когда клиент отключился
+    subscription = broker.subscribe(channels)
+    try:
+        yield 'retry: %d\n\n' % (retry * 1000)
+        while True:
+            message = await subscription.get(heartbeat)
+            if subscription.overflowed:
+                # Клиент перечитывает список целиком
+                subscription.overflowed = False
+                yield 'event: resync\ndata: {}\n\n'
+            elif message is None:
+                yield ': ping\n\n'
+            else:
+                yield format_sse(message)
+    finally:
+        subscription.close()
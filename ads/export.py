@@ -0,0 +1,95 @@
+import csv
+import datetime
+import io
+import json
+import zlib
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import Ad, ExchangeProposal
+
+# Потоковая выгрузка объявлений и предложений обмена (NDJSON/CSV, опционально gzip).
+# Строки читаются через iterator(chunk_size=...), поэтому память не растёт
+# с размером таблицы. Выгрузка упорядочена по (created_at, id), что позволяет
+# продолжать её с последней выгруженной строки.
+
+EXPORTS = {
+    'ads': (Ad, ['id', 'title', 'description', 'image_url', 'category', 'condition', 'created_at', 'user_id']),
+    'proposals': (ExchangeProposal, ['id', 'ad_sender_id', 'ad_receiver_id', 'comment', 'status', 'created_at']),
+}
+FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+
+
+def parse_since(value):
+    # Принимает ISO-дату со временем; наивное время считается UTC
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError('Invalid datetime: %s' % value)
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=datetime.timezone.utc)
+    return since
+
+
+def export_queryset(kind, since=None, since_id=None):
+    model, fields = EXPORTS[kind]
+    queryset = model.objects.order_by('created_at', 'id')
+    if since is not None and since_id is not None:
+        queryset = queryset.filter(
+            Q(created_at__gt=since) | Q(created_at=since, id__gt=since_id), created_at__gte=since,
+        )
+    elif since is not None:
+        queryset = queryset.filter(created_at__gt=since)
+    elif since_id is not None:
+        queryset = queryset.filter(id__gt=since_id)
+    return queryset.values_list(*fields), fields
+
+
+def _plain(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def iter_ndjson(rows, fields):
+    for row in rows:
+        yield (json.dumps(dict(zip(fields, map(_plain, row))), ensure_ascii=False) + '\n').encode()
+
+
+def iter_csv(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow(map(_plain, row))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Заголовок пустой выгрузки
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks, flush_size=64 * 1024):
+    compressor = zlib.compressobj(wbits=31)  # формат gzip
+    pending = []
+    size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= flush_size:
+            data = compressor.compress(b''.join(pending))
+            pending, size = [], 0
+            if data:
+                yield data
+    yield compressor.compress(b''.join(pending)) + compressor.flush()
+
+
+def export_stream(kind, fmt='ndjson', compress=False, since=None, since_id=None, chunk_size=None):
+    chunk_size = chunk_size or getattr(settings, 'ADS_EXPORT_CHUNK_SIZE', 2000)
+    queryset, fields = export_queryset(kind, since, since_id)
+    rows = queryset.iterator(chunk_size=chunk_size)
+    chunks = iter_csv(rows, fields) if fmt == 'csv' else iter_ndjson(rows, fields)
+    return gzip_chunks(chunks) if compress else chunks
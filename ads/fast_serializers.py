@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import ISO_8601, api_settings
+from rest_framework.utils import encoders
+
+from .serializers import AdSerializer, ExchangeProposalSerializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Быстрое чтение для списков и детальных страниц API: строки берутся
+# через values_list() и превращаются в словари по заранее вычисленному
+# плану полей, без создания объектов моделей и полей сериализатора
+# на каждую строку. Результат совпадает с AdSerializer/ExchangeProposalSerializer.
+
+# Поля, у которых to_representation не меняет значение из базы
+IDENTITY_FIELDS = (
+    serializers.CharField, serializers.ChoiceField, serializers.IntegerField, serializers.PrimaryKeyRelatedField,
+)
+
+
+def current_timezone():
+    return timezone.get_current_timezone() if settings.USE_TZ else None
+
+
+def _converter(field):
+    # convert(value, tz) с тем же результатом, что field.to_representation(value)
+    if isinstance(field, IDENTITY_FIELDS) and not getattr(field, 'pk_field', None):
+        return None
+    iso = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if isinstance(field, serializers.DateTimeField) and iso and iso.lower() == ISO_8601 \
+            and not hasattr(field, 'timezone'):
+        # Часовой пояс определяется один раз на пакет строк, а не для каждого значения
+        def convert(value, tz):
+            if tz is None or not timezone.is_aware(value):
+                return field.to_representation(value)
+            value = value.astimezone(tz).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return convert
+    return lambda value, tz: field.to_representation(value)
+
+
+class FieldPlan:
+    def __init__(self, serializer_class, fields=None):
+        serializer = serializer_class()
+        model = serializer.Meta.model
+        self.serializer_class = serializer_class
+        self.names, self.columns, self.converters = [], [], []
+        for name, field in serializer.fields.items():
+            if field.write_only or (fields is not None and name not in fields):
+                continue
+            if isinstance(field, serializers.MultipleChoiceField) or '.' in field.source or field.source == '*':
+                raise TypeError('%s.%s is not supported by FieldPlan' % (serializer_class.__name__, name))
+            self.names.append(name)
+            # Для внешних ключей - колонка ad_sender_id вместо объекта
+            self.columns.append(model._meta.get_field(field.source).attname)
+            self.converters.append(_converter(field))
+        self.converted = [(name, convert) for name, convert in zip(self.names, self.converters) if convert]
+
+    def subset(self, fields):
+        if fields is None:
+            return self
+        return FieldPlan(self.serializer_class, fields)
+
+    def values(self, queryset, extra=()):
+        # extra - дополнительные колонки, например поля сортировки для курсора
+        return queryset.values(*self.columns, *[name for name in extra if name not in self.columns])
+
+    def _row(self, values, tz):
+        data = PlanRow((name, values[column]) for name, column in zip(self.names, self.columns))
+        for name, convert in self.converted:
+            if data[name] is not None:
+                data[name] = convert(data[name], tz)
+        return data
+
+    def row(self, values):
+        return self._row(values, current_timezone())
+
+    def rows(self, rows):
+        tz = current_timezone()
+        return PlanRows(self._row(values, tz) for values in rows)
+
+
+class PlanRow(dict):
+    # Строка FieldPlan: значения уже приведены к str/int/bool/None
+    pass
+
+
+class PlanRows(list):
+    pass
+
+
+def is_plan_payload(data):
+    # Ответ list/retrieve из FieldPlan: строки или страница {next, previous, results}
+    if isinstance(data, (PlanRow, PlanRows)):
+        return True
+    return isinstance(data, dict) and isinstance(data.get('results'), PlanRows) \
+        and set(data) <= {'next', 'previous', 'results'}
+
+
+AD_PLAN = FieldPlan(AdSerializer)
+PROPOSAL_PLAN = FieldPlan(ExchangeProposalSerializer)
+
+
+class FastJSONRenderer(JSONRenderer):
+    # orjson, если установлен, - только для строк FieldPlan: в них нет дат, чисел
+    # с плавающей точкой и нестроковых ключей, которые orjson пишет иначе, чем JSONRenderer.
+    # Остальные ответы (ошибки, счётчики, пакеты, похожие) - обычный JSONRenderer
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or not is_plan_payload(data) or not self.compact or self.ensure_ascii
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = orjson.dumps(data, default=encoders.JSONEncoder().default)
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
@@ -1,6 +1,7 @@
 from django import forms
 from .models import Ad, ExchangeProposal, User
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
+from .auth import get_login_throttle
 
 
 class AdForm(forms.ModelForm):
@@ -32,4 +33,15 @@ class SignUpForm(UserCreationForm):
 
 class LoginForm(AuthenticationForm):
     username = forms.CharField(label='Имя пользователя')
-    password = forms.CharField(label='Пароль', widget=forms.PasswordInput)
\ No newline at end of file
+    password = forms.CharField(label='Пароль', widget=forms.PasswordInput)
+
+    error_messages = {
+        **AuthenticationForm.error_messages,
+        'throttled': 'Слишком много неудачных попыток входа. Повторите позже.',
+    }
+
+    def clean(self):
+        # Заблокированная попытка отклоняется до проверки пароля
+        if get_login_throttle().blocked(self.request, self.cleaned_data.get('username')):
+            raise forms.ValidationError(self.error_messages['throttled'], code='throttled')
+        return super().clean()
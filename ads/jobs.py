@@ -0,0 +1,197 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Очередь фоновых задач в основной базе. Задача ставится в той же транзакции,
+# что и изменения, которые её породили, и становится видна исполнителям после
+# фиксации. Исполнитель (manage.py run_jobs) забирает задачу условным UPDATE
+# (работает и на SQLite без SELECT ... FOR UPDATE), при ошибке задача
+# откладывается с экспоненциальной задержкой, после max_attempts - failed.
+#
+# При ADS_BACKGROUND_JOBS = False (по умолчанию) defer() выполняет задачу сразу
+# в текущем процессе - поведение как без очереди.
+
+
+def jobs_options():
+    return {
+        'visibility_timeout': getattr(settings, 'ADS_JOBS_VISIBILITY_TIMEOUT', 300),
+        'max_attempts': getattr(settings, 'ADS_JOBS_MAX_ATTEMPTS', 5),
+        'backoff_base': getattr(settings, 'ADS_JOBS_BACKOFF_BASE', 5),
+        'backoff_max': getattr(settings, 'ADS_JOBS_BACKOFF_MAX', 60 * 60),
+    }
+
+
+def background_jobs():
+    return getattr(settings, 'ADS_BACKGROUND_JOBS', False)
+
+
+def enqueue(task, *args, key=None, delay=0, max_attempts=None):
+    # Новая задача или уже поставленная с тем же ключом идемпотентности
+    if key is not None:
+        existing = Job.objects.filter(key=key).first()
+        if existing is not None:
+            return existing
+    job = Job(
+        task=task, args=list(args), key=key, run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or jobs_options()['max_attempts'],
+    )
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        # Задачу с этим ключом успели поставить параллельно
+        if key is None:
+            raise
+        return Job.objects.get(key=key)
+    return job
+
+
+def defer(task, *args, key=None, on_commit=False):
+    # Фоновая задача при ADS_BACKGROUND_JOBS, иначе выполнение сразу
+    # (on_commit=True - после фиксации текущей транзакции)
+    if background_jobs():
+        return enqueue(task, *args, key=key)
+    if on_commit:
+        transaction.on_commit(lambda: import_string(task)(*args))
+    else:
+        import_string(task)(*args)
+    return None
+
+
+def backoff(attempts, base, maximum):
+    # 1-я повторная попытка через base секунд, дальше вдвое дольше; ±10% разброса
+    delay = min(maximum, base * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.9, 1.1)
+
+
+class JobWorker:
+    def __init__(self, name=None, visibility_timeout=None):
+        options = jobs_options()
+        self.name = name or '%s:%d:%d' % (socket.gethostname(), os.getpid(), threading.get_ident())
+        self.visibility_timeout = visibility_timeout or options['visibility_timeout']
+        self.backoff_base = options['backoff_base']
+        self.backoff_max = options['backoff_max']
+
+    def ready(self, now):
+        # Задачи в очереди, срок которых наступил, и задачи с истёкшей арендой
+        return Q(status='queued', run_at__lte=now) | Q(status='running', locked_until__lt=now)
+
+    def claim(self, batch=10):
+        # Условный UPDATE по каждому кандидату: задачу получает один исполнитель.
+        # Если всех кандидатов разобрали другие, выбираются следующие
+        while True:
+            now = timezone.now()
+            candidates = list(
+                Job.objects.filter(self.ready(now)).order_by('run_at', 'id').values_list('id', flat=True)[:batch]
+            )
+            if not candidates:
+                return None
+            for pk in candidates:
+                claimed = Job.objects.filter(self.ready(now), pk=pk).update(
+                    status='running', locked_by=self.name, attempts=F('attempts') + 1,
+                    locked_until=now + timedelta(seconds=self.visibility_timeout), updated_at=now,
+                )
+                if claimed:
+                    return Job.objects.get(pk=pk)
+
+    def execute(self, job):
+        try:
+            import_string(job.task)(*job.args)
+        except Exception:
+            error = traceback.format_exc()
+            logger.warning('Job %s (%s) failed, attempt %d', job.pk, job.task, job.attempts, exc_info=True)
+            now = timezone.now()
+            if job.attempts >= job.max_attempts:
+                changes = {'status': 'failed'}
+            else:
+                delay = backoff(job.attempts, self.backoff_base, self.backoff_max)
+                changes = {'status': 'queued', 'run_at': now + timedelta(seconds=delay)}
+            self._finish(job, last_error=error, **changes)
+            return False
+        self._finish(job, status='done', last_error='')
+        return True
+
+    def _finish(self, job, finish_retries=5, **changes):
+        # Только пока аренда наша: иначе задачу уже взял другой исполнитель.
+        # Задача уже выполнена, поэтому при занятой базе запись результата повторяется
+        for attempt in range(finish_retries):
+            try:
+                updated = Job.objects.filter(pk=job.pk, status='running', locked_by=self.name).update(
+                    locked_until=None, updated_at=timezone.now(), **changes,
+                )
+                break
+            except DatabaseError:
+                if attempt == finish_retries - 1:
+                    raise
+                time.sleep(0.05 * 2 ** attempt)
+        if not updated:
+            logger.warning('Job %s lease expired before it finished', job.pk)
+
+    def run_once(self):
+        # Одна задача; False, если выполнять нечего
+        job = self.claim()
+        if job is None:
+            return False
+        self.execute(job)
+        return True
+
+    def run(self, stop=None, poll=1.0, once=False):
+        # once=True - до опустошения очереди; иначе до stop.set().
+        # Для отдельного потока или процесса: соединения с базой закрываются по завершении
+        stop = stop or threading.Event()
+        processed = 0
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                try:
+                    if self.run_once():
+                        processed += 1
+                        continue
+                except DatabaseError:
+                    # База занята или недоступна: задача останется в очереди или вернётся после аренды
+                    logger.warning('Job worker %s: database error', self.name, exc_info=True)
+                    stop.wait(poll)
+                    continue
+                if once:
+                    break
+                purge_finished()
+                stop.wait(poll)
+        finally:
+            connections.close_all()
+        return processed
+
+
+_last_purge = 0.0
+
+
+def purge_finished(force=False):
+    # Выполненные задачи хранятся ADS_JOBS_KEEP_DONE секунд; чистка не чаще раза в 10 минут
+    global _last_purge
+    if not force and time.monotonic() - _last_purge < 600:
+        return 0
+    _last_purge = time.monotonic()
+    keep = getattr(settings, 'ADS_JOBS_KEEP_DONE', 24 * 60 * 60)
+    deleted, _ = Job.objects.filter(status='done', updated_at__lt=timezone.now() - timedelta(seconds=keep)).delete()
+    return deleted
+
+
+def run_process(poll, once):
+    # Точка входа дочернего процесса пула (при spawn Django настраивается заново)
+    import django
+    django.setup()
+    JobWorker().run(poll=poll, once=once)
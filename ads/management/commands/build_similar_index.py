@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ads.similar import get_index, np
+
+
+class Command(BaseCommand):
+    help = 'Собирает индекс похожих объявлений (нужен numpy)'
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('Установите numpy: pip install numpy')
+        index = get_index()
+        count = index.build()
+        self.stdout.write(self.style.SUCCESS('Объявлений в индексе: %d (%s)' % (count, index.path)))
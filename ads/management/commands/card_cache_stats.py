@@ -0,0 +1,17 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from ads.card_cache import card_cache_stats, reset_card_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэша карточек объявлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Обнулить счётчики после вывода')
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(card_cache_stats()))
+        if options['reset']:
+            reset_card_cache_stats()
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ads.export import EXPORTS, FORMATS, export_stream, parse_since
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка объявлений или предложений обмена в NDJSON/CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--output', default='-', help="Файл или '-' для stdout")
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--since', help='Выгрузить строки, созданные после этого момента (ISO 8601)')
+        parser.add_argument('--since-id', type=int, help='id последней выгруженной строки')
+        parser.add_argument('--chunk-size', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_since(options['since']) if options['since'] else None
+        except ValueError as exc:
+            raise CommandError(exc)
+        chunks = export_stream(
+            options['kind'], options['format'], options['gzip'],
+            since, options['since_id'], options['chunk_size'],
+        )
+        if options['output'] == '-':
+            stream = sys.stdout.buffer
+            for chunk in chunks:
+                stream.write(chunk)
+            stream.flush()
+        else:
+            with open(options['output'], 'wb') as stream:
+                for chunk in chunks:
+                    stream.write(chunk)
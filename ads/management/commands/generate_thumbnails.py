@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ads.models import Ad
+from ads.thumbnails import Image, ThumbnailWorker, get_worker
+
+
+class Command(BaseCommand):
+    help = 'Строит недостающие миниатюры для image_url всех объявлений (нужен Pillow)'
+
+    def handle(self, *args, **options):
+        if Image is None:
+            raise CommandError('Установите Pillow: pip install Pillow')
+        cache = get_worker().cache
+        # Без фонового пула: миниатюры строятся по очереди в этом процессе
+        worker = ThumbnailWorker(cache, workers=0)
+        urls = Ad.objects.exclude(image_url__isnull=True).exclude(image_url='').values_list(
+            'image_url', flat=True,
+        ).distinct().iterator()
+        built = failed = 0
+        for url in urls:
+            if cache.get(url):
+                continue
+            worker.generate(url)
+            if cache.get(url):
+                built += 1
+            else:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS('Построено: %d, ошибок: %d' % (built, failed)))
@@ -0,0 +1,34 @@
+import json
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from ads.bulk_import import FORMATS, AdImporter, detect_format
+
+
+class Command(BaseCommand):
+    help = 'Импортирует объявления из файла NDJSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Путь к файлу или '-' для stdin")
+        parser.add_argument('--user', required=True, help='Имя пользователя-владельца объявлений')
+        parser.add_argument('--format', choices=FORMATS, help='По умолчанию определяется по расширению')
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('Пользователь %s не найден' % options['user'])
+        fmt = options['format'] or detect_format(filename=options['path'])
+        if fmt is None:
+            raise CommandError('Не удалось определить формат, укажите --format')
+
+        importer = AdImporter(user, options['batch_size'])
+        if options['path'] == '-':
+            report = importer.run(sys.stdin.buffer, fmt)
+        else:
+            with open(options['path'], 'rb') as stream:
+                report = importer.run(stream, fmt)
+        self.stdout.write(json.dumps(report.as_dict(), ensure_ascii=False))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from ads.matching import rebuild_chains
+from ads.models import DesireEdge
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает граф желаний и цепочки обмена'
+
+    def handle(self, *args, **options):
+        DesireEdge.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS('Цепочек: %d' % rebuild_chains()))
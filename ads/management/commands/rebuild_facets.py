@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ads.models import AdFacet
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики объявлений по категориям и состояниям'
+
+    def handle(self, *args, **options):
+        AdFacet.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS('Фасетов: %d' % AdFacet.objects.count()))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from ads.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Пересоздаёт полнотекстовый индекс объявлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(options['database'])
+        backend.install()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS('Индекс %s пересобран' % type(backend).__name__))
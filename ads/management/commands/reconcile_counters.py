@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from ads.models import Ad, UserAdCounter
+
+
+class Command(BaseCommand):
+    help = 'Сверяет счётчики предложений объявлений и объявлений пользователей с данными и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Сколько id обрабатывать в одной транзакции')
+
+    def handle(self, *args, **options):
+        chunk_size = max(options['chunk_size'], 1)
+        ads = Ad.objects.reconcile(chunk_size)
+        users = UserAdCounter.objects.reconcile(chunk_size)
+        self.stdout.write(self.style.SUCCESS('Исправлено объявлений: %d, пользователей: %d' % (ads, users)))
@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from ads.benchmarks import SUITES, run
+
+
+class Command(BaseCommand):
+    help = 'Замеры производительности основных представлений на синтетических данных (JSON)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000',
+                            help='Размеры базы (число объявлений) через запятую, например 10000,100000,1000000')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--suite', action='append', choices=sorted(SUITES), dest='suites')
+        parser.add_argument('--scenario', action='append', dest='scenarios')
+        parser.add_argument('--output', help='Файл для JSON-отчёта (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        # Замеры идут на отдельной тестовой базе, рабочая не затрагивается
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            report = run(sizes, options['repeat'], options['suites'], options['scenarios'], stdout=self.stderr)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        payload = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                stream.write(payload)
+        else:
+            self.stdout.write(payload)
@@ -0,0 +1,54 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from ads.jobs import JobWorker, run_process
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди Job пулом потоков или процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--processes', action='store_true', help='Процессы вместо потоков')
+        parser.add_argument('--poll', type=float, default=1.0, help='Пауза при пустой очереди, с')
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задачи и завершиться')
+
+    def handle(self, *args, **options):
+        workers, poll, once = max(1, options['workers']), options['poll'], options['once']
+        if options['processes']:
+            # Соединения с базой не должны наследоваться дочерними процессами
+            connections.close_all()
+            pool = [multiprocessing.Process(target=run_process, args=(poll, once)) for _ in range(workers)]
+            for process in pool:
+                process.start()
+            try:
+                for process in pool:
+                    process.join()
+            except KeyboardInterrupt:
+                for process in pool:
+                    process.terminate()
+            return
+
+        stop = threading.Event()
+        processed = []
+        threads = [
+            threading.Thread(target=lambda: processed.append(JobWorker().run(stop, poll, once)), name='jobs-%d' % i)
+            for i in range(workers)
+        ]
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        self.stdout.write(self.style.SUCCESS('Выполнено задач: %d' % sum(processed)))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from ads.seeding import seed
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими пользователями, объявлениями и предложениями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--ads', type=int, default=1000)
+        parser.add_argument('--proposals', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора случайных чисел')
+        parser.add_argument('--days', type=int, default=365, help='Разброс дат создания')
+
+    def handle(self, *args, **options):
+        seed(options['users'], options['ads'], options['proposals'], options['seed'], options['days'],
+             stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ads.replicas import replica_aliases, sync_replicas
+
+
+class Command(BaseCommand):
+    help = 'Копирует основную базу SQLite в реплики для чтения (ADS_DB_REPLICAS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые N секунд (0 - один раз)')
+
+    def handle(self, *args, **options):
+        if not replica_aliases():
+            raise CommandError('Реплики не настроены: ADS_DB_REPLICAS пуст')
+        while True:
+            try:
+                aliases = sync_replicas()
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write('Реплики обновлены: %s' % ', '.join(aliases))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
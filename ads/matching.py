@@ -0,0 +1,221 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from .jobs import background_jobs, enqueue
+from .models import BarterChain, BarterChainMember, DesireEdge, ExchangeProposal
+
+# Цепочки обмена A→B→C→A. Граф желаний хранится в DesireEdge: ребро u→v,
+# если у пользователя u есть ожидающее предложение к объявлению пользователя v.
+# Граф обновляется инкрементально (счётчики через F()); при появлении ребра u→v
+# ищутся только циклы через него - пути v→…→u длиной до k-1, при исчезновении
+# удаляются цепочки, содержащие ребро. Вся таблица не перечитывается.
+#
+# Поиск пути идёт с двух сторон: вперёд от v на половину длины и назад от u
+# на оставшуюся часть, затем перебор путей с отсечением по расстоянию до u.
+# Для k=4 это три запроса по индексам независимо от размера графа.
+
+
+def chain_options():
+    return {
+        'max_length': getattr(settings, 'ADS_CHAIN_MAX_LENGTH', 4),
+        'max_nodes': getattr(settings, 'ADS_CHAIN_MAX_NODES', 10000),
+        'limit': getattr(settings, 'ADS_CHAIN_MAX_RESULTS', 100),
+    }
+
+
+class MemoryGraph:
+    # Граф в памяти: пересчёт всех цепочек и нагрузочные замеры
+    def __init__(self, edges=()):
+        self.succ = defaultdict(set)
+        self.pred = defaultdict(set)
+        self.edge_count = 0
+        for u, v in edges:
+            self.add_edge(u, v)
+
+    def add_edge(self, u, v):
+        if u != v and v not in self.succ[u]:
+            self.succ[u].add(v)
+            self.pred[v].add(u)
+            self.edge_count += 1
+
+    def remove_edge(self, u, v):
+        if v in self.succ.get(u, ()):
+            self.succ[u].discard(v)
+            self.pred[v].discard(u)
+            self.edge_count -= 1
+
+    def edges(self):
+        return [(u, v) for u, targets in self.succ.items() for v in targets]
+
+    def successors(self, nodes):
+        return [(x, y) for x in nodes for y in self.succ.get(x, ())]
+
+    def predecessors(self, nodes):
+        return [(x, y) for y in nodes for x in self.pred.get(y, ())]
+
+
+class DatabaseGraph:
+    # Тот же интерфейс поверх DesireEdge: один запрос на слой обхода
+    def __init__(self, using=None):
+        self.edges = DesireEdge.objects.db_manager(using).filter(proposal_count__gt=0)
+
+    def successors(self, nodes):
+        return list(self.edges.filter(from_user__in=nodes).values_list('from_user', 'to_user'))
+
+    def predecessors(self, nodes):
+        return list(self.edges.filter(to_user__in=nodes).values_list('from_user', 'to_user'))
+
+
+def _expand(edges_of, start, depth, max_nodes, forward):
+    # Обход в ширину на depth слоёв: ({узел: расстояние}, найденные рёбра)
+    distance = {start: 0}
+    frontier = [start]
+    edges = []
+    for level in range(1, depth + 1):
+        if not frontier or len(distance) > max_nodes:
+            break
+        found = edges_of(frontier)
+        frontier = []
+        for x, y in found:
+            edges.append((x, y))
+            node = y if forward else x
+            if node not in distance:
+                distance[node] = level
+                frontier.append(node)
+    return distance, edges
+
+
+def normalize(cycle):
+    # Один и тот же цикл с любой точки начинается с наименьшего участника
+    start = cycle.index(min(cycle))
+    return tuple(cycle[start:] + cycle[:start])
+
+
+def find_cycles(graph, u, v, max_length=4, max_nodes=10000, limit=100):
+    # Простые циклы длиной до max_length, проходящие через ребро u→v.
+    # max_nodes ограничивает обход для «популярных» пользователей, limit - число результатов
+    if u == v or max_length < 2:
+        return []
+    span = max_length - 1  # рёбер в пути v→…→u
+    forward_depth = span // 2
+    backward_depth = span - forward_depth
+    _, forward_edges = _expand(graph.successors, v, forward_depth, max_nodes, True)
+    distance, backward_edges = _expand(graph.predecessors, u, backward_depth, max_nodes, False)
+    succ = defaultdict(set)
+    for x, y in forward_edges + backward_edges:
+        succ[x].add(y)
+    # Для узлов вне обратного обхода до u не меньше backward_depth + 1 рёбер
+    unknown = backward_depth + 1
+
+    cycles = []
+    path = [v]
+    on_path = {u, v}
+
+    def visit(x):
+        for y in sorted(succ.get(x, ())):
+            if len(cycles) >= limit:
+                return
+            if y == u:
+                cycles.append(normalize([u] + path))
+            elif y not in on_path and len(path) + distance.get(y, unknown) <= span:
+                path.append(y)
+                on_path.add(y)
+                visit(y)
+                path.pop()
+                on_path.discard(y)
+
+    visit(v)
+    return cycles
+
+
+def chain_key(cycle):
+    return '-'.join(map(str, cycle))
+
+
+def save_chains(cycles, using=None):
+    # Новые цепочки (уже сохранённые пропускаются); возвращает созданные
+    cycles = {chain_key(cycle): cycle for cycle in cycles}
+    for attempt in range(2):
+        chains = BarterChain.objects.db_manager(using)
+        existing = set(chains.filter(key__in=cycles).values_list('key', flat=True))
+        new = [BarterChain(key=key, length=len(cycle)) for key, cycle in cycles.items() if key not in existing]
+        try:
+            with transaction.atomic(using=using):
+                chains.bulk_create(new)
+                BarterChainMember.objects.db_manager(using).bulk_create(
+                    BarterChainMember(chain=chain, user_id=user, next_user_id=cycle[(i + 1) % len(cycle)], position=i)
+                    for chain in new
+                    for cycle in [cycles[chain.key]]
+                    for i, user in enumerate(cycle)
+                )
+        except IntegrityError:
+            # Те же цепочки нашёл параллельный запрос: повторяем без них
+            if attempt:
+                raise
+            continue
+        return new
+
+
+def drop_chains(edges, using=None):
+    # Цепочки, в которых есть одно из рёбер
+    condition = Q()
+    for u, v in edges:
+        condition |= Q(members__user=u, members__next_user=v)
+    if condition:
+        BarterChain.objects.db_manager(using).filter(condition).delete()
+
+
+def edges_changed(deltas, using=None):
+    # Вызывается DesireEdge.objects.adjust после изменения счётчиков рёбер
+    touched = [key for key, delta in deltas.items() if delta]
+    if not touched:
+        return
+    counts = {
+        (u, v): count for u, v, count in DesireEdge.objects.db_manager(using).filter(
+            from_user__in={u for u, _ in touched}, to_user__in={v for _, v in touched},
+        ).values_list('from_user', 'to_user', 'proposal_count')
+    }
+    drop_chains([key for key in touched if deltas[key] < 0 and counts.get(key, 0) <= 0], using)
+    # Ребро новое, если до изменения счётчик был нулевым
+    added = [key for key in touched if deltas[key] > 0 and counts.get(key) == deltas[key]]
+    if not added:
+        return
+    if background_jobs():
+        # Поиск циклов - медленная часть, удаление цепочек выше остаётся в запросе
+        enqueue('ads.tasks.find_chains', [list(edge) for edge in added])
+    else:
+        find_new_chains(added, using)
+
+
+def find_new_chains(edges, using=None):
+    graph = DatabaseGraph(using)
+    options = chain_options()
+    return save_chains([cycle for u, v in edges for cycle in find_cycles(graph, u, v, **options)], using)
+
+
+def rebuild_chains():
+    # Полный пересчёт: граф целиком в памяти, каждый цикл находится через каждое своё ребро
+    graph = MemoryGraph(DesireEdge.objects.filter(proposal_count__gt=0).values_list('from_user', 'to_user').iterator())
+    options = chain_options()
+    cycles = {}
+    for u, v in graph.edges():
+        for cycle in find_cycles(graph, u, v, **options):
+            cycles[chain_key(cycle)] = cycle
+    with transaction.atomic():
+        BarterChain.objects.all().delete()
+        save_chains(cycles.values())
+    return len(cycles)
+
+
+def chain_proposals(chains):
+    # {(from_user, to_user): последнее ожидающее предложение} для шагов цепочек - один запрос
+    pairs = {(member.user_id, member.next_user_id) for chain in chains for member in chain.members.all()}
+    if not pairs:
+        return {}
+    rows = ExchangeProposal.objects.filter(
+        status='pending', sender_user__in={u for u, _ in pairs}, receiver_user__in={v for _, v in pairs},
+    ).order_by('created_at', 'id').values_list('sender_user', 'receiver_user', 'id', 'ad_sender', 'ad_receiver')
+    return {(row[0], row[1]): row[2:] for row in rows if (row[0], row[1]) in pairs}
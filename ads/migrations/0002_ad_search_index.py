@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from ads.search import get_search_backend
+    get_search_backend(schema_editor.connection.alias).install(rebuild=True)
+
+
+def drop_search_index(apps, schema_editor):
+    from ads.search import get_search_backend
+    get_search_backend(schema_editor.connection.alias).uninstall()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-18 19:20
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_facets(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    AdFacet = apps.get_model('ads', 'AdFacet')
+    counts = Ad.objects.values('category', 'condition').annotate(total=Count('id')).order_by()
+    AdFacet.objects.bulk_create(
+        AdFacet(category=row['category'], condition=row['condition'], ad_count=row['total'])
+        for row in counts
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0003_ad_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=100)),
+                ('condition', models.CharField(choices=[('new', 'Новый'), ('used', 'Б/у')], max_length=10)),
+                ('ad_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'condition'), name='ad_facet_unique')],
+            },
+        ),
+        migrations.RunPython(populate_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 19:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0004_ad_facets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
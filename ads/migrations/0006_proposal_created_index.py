@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0005_ad_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exchangeproposal',
+            index=models.Index(fields=['created_at'], name='proposal_created_idx'),
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 5.2 on 2026-10-18 19:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def fill_proposal_users(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    ExchangeProposal = apps.get_model('ads', 'ExchangeProposal')
+    proposals = ExchangeProposal.objects.using(schema_editor.connection.alias)
+    proposals.update(
+        sender_user=Subquery(Ad.objects.filter(pk=OuterRef('ad_sender')).values('user')[:1]),
+        receiver_user=Subquery(Ad.objects.filter(pk=OuterRef('ad_receiver')).values('user')[:1]),
+    )
+    # Старое представление create_exchange_proposal сохраняло статус, которого нет в choices
+    proposals.filter(status='ожидает').update(status='pending')
+
+
+def fill_proposal_counters(apps, schema_editor):
+    ExchangeProposal = apps.get_model('ads', 'ExchangeProposal')
+    ProposalCounter = apps.get_model('ads', 'ProposalCounter')
+    alias = schema_editor.connection.alias
+    counters = []
+    for box, owner in (('inbox', 'receiver_user'), ('outbox', 'sender_user')):
+        rows = ExchangeProposal.objects.using(alias).values_list(owner, 'status').annotate(total=Count('id')).order_by()
+        counters += [
+            ProposalCounter(user_id=user_id, box=box, status=status, proposal_count=total)
+            for user_id, status, total in rows
+        ]
+    ProposalCounter.objects.using(alias).bulk_create(counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0007_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exchangeproposal',
+            name='receiver_user',
+            field=models.ForeignKey(null=True, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='inbox_proposals', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='exchangeproposal',
+            name='sender_user',
+            field=models.ForeignKey(null=True, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='outbox_proposals', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(fill_proposal_users, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='exchangeproposal',
+            name='receiver_user',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='inbox_proposals', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='exchangeproposal',
+            name='sender_user',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='outbox_proposals', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='exchangeproposal',
+            index=models.Index(fields=['receiver_user', 'created_at'], name='proposal_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangeproposal',
+            index=models.Index(fields=['receiver_user', 'status', 'created_at'], name='proposal_inbox_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangeproposal',
+            index=models.Index(fields=['sender_user', 'created_at'], name='proposal_outbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangeproposal',
+            index=models.Index(fields=['sender_user', 'status', 'created_at'], name='proposal_outbox_status_idx'),
+        ),
+        migrations.CreateModel(
+            name='ProposalCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('box', models.CharField(choices=[('inbox', 'inbox'), ('outbox', 'outbox')], max_length=6)),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('accepted', 'Принята'), ('rejected', 'Отклонена')], max_length=10)),
+                ('proposal_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='proposal_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'box', 'status'), name='proposal_counter_unique')],
+            },
+        ),
+        migrations.RunPython(fill_proposal_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2 on 2026-10-18 20:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def fill_desire_edges(apps, schema_editor):
+    # Рёбра графа желаний из ожидающих предложений; цепочки - командой rebuild_chains
+    ExchangeProposal = apps.get_model('ads', 'ExchangeProposal')
+    DesireEdge = apps.get_model('ads', 'DesireEdge')
+    alias = schema_editor.connection.alias
+    rows = ExchangeProposal.objects.using(alias).filter(status='pending').exclude(
+        sender_user=F('receiver_user'),
+    ).values_list('sender_user', 'receiver_user').annotate(total=Count('id')).order_by()
+    DesireEdge.objects.using(alias).bulk_create(
+        DesireEdge(from_user_id=sender, to_user_id=receiver, proposal_count=total) for sender, receiver, total in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0008_proposal_boxes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BarterChain',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('length', models.PositiveSmallIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='chain_created_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BarterChainMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('chain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='ads.barterchain')),
+                ('next_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'chain'], name='chain_member_user_idx'), models.Index(fields=['user', 'next_user'], name='chain_member_edge_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DesireEdge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('proposal_count', models.IntegerField(default=0)),
+                ('from_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('to_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['to_user', 'from_user'], name='desire_edge_reverse_idx')],
+                'constraints': [models.UniqueConstraint(fields=('from_user', 'to_user'), name='desire_edge_unique')],
+            },
+        ),
+        migrations.RunPython(fill_desire_edges, migrations.RunPython.noop),
+    ]
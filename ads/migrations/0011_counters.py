@@ -0,0 +1,73 @@
+# Generated by Django 5.2 on 2026-10-18 21:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_ad_counters(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    ExchangeProposal = apps.get_model('ads', 'ExchangeProposal')
+    alias = schema_editor.connection.alias
+
+    def count(column, **filters):
+        proposals = ExchangeProposal.objects.filter(**{column: OuterRef('pk')}, **filters)
+        return Coalesce(Subquery(proposals.values(column).annotate(total=Count('id')).values('total')[:1]), 0)
+
+    Ad.objects.using(alias).update(
+        received_count=count('ad_receiver'),
+        sent_count=count('ad_sender'),
+        pending_count=count('ad_receiver', status='pending'),
+    )
+
+
+def fill_user_ad_counters(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    UserAdCounter = apps.get_model('ads', 'UserAdCounter')
+    alias = schema_editor.connection.alias
+    rows = Ad.objects.using(alias).values_list('user').annotate(total=Count('id')).order_by()
+    UserAdCounter.objects.using(alias).bulk_create(
+        UserAdCounter(user_id=user_id, ad_count=total) for user_id, total in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0010_jobs'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAdCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ad_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('ad_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='pending_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='received_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='sent_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['received_count'], name='ad_received_idx'),
+        ),
+        migrations.RunPython(fill_ad_counters, migrations.RunPython.noop),
+        migrations.RunPython(fill_user_ad_counters, migrations.RunPython.noop),
+    ]
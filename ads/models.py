@@ -1,5 +1,77 @@
-from django.db import models
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Sum
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+# Накопленные изменения счётчиков внутри deferred_counters(): {модель: Counter}
+_pending_counters = ContextVar('pending_counters', default=None)
+
+
+def _defer_counters(model, deltas):
+    # True, если изменения отложены до конца блока deferred_counters()
+    pending = _pending_counters.get()
+    if pending is None:
+        return False
+    pending.setdefault(model, Counter()).update(deltas)
+    return True
+
+
+class AdManager(models.Manager):
+    # Денормализованные счётчики предложений в строке объявления
+    def adjust(self, deltas):
+        # deltas: {(id объявления, поле счётчика): изменение}; один UPDATE на объявление.
+        # updated_at меняется вместе со счётчиками: ETag списков и карточки API тоже
+        if not any(deltas.values()) or _defer_counters(self.model, deltas):
+            return
+        changes = {}
+        for (pk, field), delta in sorted(deltas.items()):
+            if delta:
+                changes.setdefault(pk, {})[field] = F(field) + delta
+        now = timezone.now()
+        # Точка сохранения не нужна: при ошибке откатывается вся внешняя транзакция
+        with transaction.atomic(using=self.db, savepoint=False) if len(changes) > 1 else nullcontext():
+            for pk, fields in changes.items():
+                # Удалённого объявления уже нет: UPDATE ничего не затронет
+                self.filter(pk=pk).update(**fields, updated_at=now)
+
+    def reconcile(self, chunk_size=1000):
+        # Пересчёт счётчиков по диапазонам id; возвращает число исправленных объявлений
+        fixed = 0
+        last = self.order_by('-pk').values_list('pk', flat=True).first() or 0
+        for start in range(0, last, chunk_size):
+            with transaction.atomic(using=self.db):
+                fixed += self._reconcile_range(start, start + chunk_size)
+        return fixed
+
+    def _reconcile_range(self, start, end):
+        actual = {}
+        proposals = ExchangeProposal.objects.using(self.db)
+        for field, column, queryset in (
+            ('received_count', 'ad_receiver', proposals),
+            ('sent_count', 'ad_sender', proposals),
+            ('pending_count', 'ad_receiver', proposals.filter(status='pending')),
+        ):
+            rows = queryset.filter(**{'%s__gt' % column: start, '%s__lte' % column: end}).values_list(
+                column,
+            ).annotate(total=Count('id')).order_by()
+            for pk, total in rows:
+                actual.setdefault(pk, dict.fromkeys(Ad.COUNTER_FIELDS, 0))[field] = total
+        now = timezone.now()
+        stale = []
+        for ad in self.filter(pk__gt=start, pk__lte=end).only('pk', *Ad.COUNTER_FIELDS):
+            counts = actual.get(ad.pk, dict.fromkeys(Ad.COUNTER_FIELDS, 0))
+            if any(getattr(ad, field) != counts[field] for field in Ad.COUNTER_FIELDS):
+                for field, total in counts.items():
+                    setattr(ad, field, total)
+                ad.updated_at = now
+                stale.append(ad)
+        self.bulk_update(stale, [*Ad.COUNTER_FIELDS, 'updated_at'])
+        return len(stale)
+
 
 class Ad(models.Model):
     title = models.CharField(max_length=255)
@@ -13,6 +85,218 @@ class Ad(models.Model):
     condition = models.CharField(max_length=10, choices=condition_choices)
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ads')
+    # Номер ревизии, увеличивается при каждом сохранении (ключ кэша карточки)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # Время последнего изменения (ETag/Last-Modified)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Счётчики предложений (полученные, отправленные, ожидающие ответа среди полученных).
+    # Меняются только через Ad.objects.adjust, save() их не записывает
+    received_count = models.IntegerField(default=0, editable=False)
+    sent_count = models.IntegerField(default=0, editable=False)
+    pending_count = models.IntegerField(default=0, editable=False)
+
+    COUNTER_FIELDS = ('received_count', 'sent_count', 'pending_count')
+
+    objects = AdManager()
+
+    class Meta:
+        # Индексы под фильтры и сортировки ad_list
+        indexes = [
+            models.Index(fields=['created_at'], name='ad_created_idx'),
+            models.Index(fields=['title'], name='ad_title_idx'),
+            models.Index(fields=['category', 'created_at'], name='ad_category_created_idx'),
+            models.Index(fields=['condition', 'created_at'], name='ad_condition_created_idx'),
+            models.Index(fields=['user', 'created_at'], name='ad_user_created_idx'),
+            # MAX(updated_at) для ETag списков
+            models.Index(fields=['updated_at'], name='ad_updated_idx'),
+            # Сортировка по числу полученных предложений
+            models.Index(fields=['received_count'], name='ad_received_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем исходные категорию и состояние для пересчёта фасетов при сохранении
+        if 'category' in field_names and 'condition' in field_names:
+            instance._loaded_facet = (instance.category, instance.condition)
+        return instance
+
+    def save(self, *args, **kwargs):
+        updating = not self._state.adding
+        if updating:
+            # Версия увеличивается в самом UPDATE: при одновременных сохранениях
+            # ни одно приращение не теряется и ключ кэша карточки всегда новый
+            self.version = F('version') + 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                # Все загруженные поля, кроме счётчиков: их прочитанные значения
+                # могли устареть, пока объявление редактировали
+                deferred = self.get_deferred_fields()
+                update_fields = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.attname not in deferred
+                ]
+            kwargs['update_fields'] = {*update_fields, 'version', 'updated_at'}.difference(self.COUNTER_FIELDS)
+        super().save(*args, **kwargs)
+        if updating:
+            self.refresh_from_db(fields=['version'])
+
+    @property
+    def facet_key(self):
+        return self.category, self.condition
+
+    @property
+    def author_ad_count(self):
+        # Читать вместе с объявлением: select_related('user__ad_counter')
+        try:
+            return self.user.ad_counter.ad_count
+        except UserAdCounter.DoesNotExist:
+            return 0
+
+    @property
+    def thumbnail_url(self):
+        from .thumbnails import thumbnail_url
+        return thumbnail_url(self.image_url)
+
+
+@contextmanager
+def deferred_counters():
+    # Для массовых операций: изменения счётчиков от сигналов копятся
+    # и применяются одним adjust на модель в конце блока
+    if _pending_counters.get() is not None:
+        yield
+        return
+    pending = {}
+    token = _pending_counters.set(pending)
+    try:
+        yield
+    finally:
+        _pending_counters.reset(token)
+    for model, deltas in pending.items():
+        model.objects.adjust(deltas)
+
+
+class CounterManager(models.Manager):
+    # Материализованные счётчики: строка на ключ key_fields, значение в count_field
+    key_fields = ()
+    count_field = None
+
+    def adjust(self, deltas):
+        # deltas: {ключ: изменение количества}
+        if not any(deltas.values()) or _defer_counters(self.model, deltas):
+            return
+        changes = [(key, delta) for key, delta in sorted(deltas.items()) if delta]
+        # Одно изменение - один UPDATE, точка сохранения нужна только для нескольких
+        with transaction.atomic(using=self.db) if len(changes) > 1 else nullcontext():
+            for key, delta in changes:
+                lookup = dict(zip(self.key_fields, key))
+                counter = self.filter(**lookup)
+                if counter.update(**{self.count_field: F(self.count_field) + delta}) or delta < 0:
+                    # Нет строки - нечего уменьшать (например, её уже удалил каскад)
+                    continue
+                try:
+                    with transaction.atomic(using=self.db):
+                        self.create(**lookup, **{self.count_field: delta})
+                except IntegrityError:
+                    # Строку успели создать параллельно
+                    counter.update(**{self.count_field: F(self.count_field) + delta})
+        self.adjusted(deltas)
+
+    def adjusted(self, deltas):
+        # Вызывается после применения изменений (в том числе отложенных)
+        pass
+
+
+class AdFacetManager(CounterManager):
+    key_fields = ('category', 'condition')
+    count_field = 'ad_count'
+
+    def rebuild(self):
+        counts = Ad.objects.values('category', 'condition').annotate(total=Count('id')).order_by()
+        with transaction.atomic(using=self.db):
+            self.all().delete()
+            self.bulk_create(
+                AdFacet(category=row['category'], condition=row['condition'], ad_count=row['total'])
+                for row in counts
+            )
+
+    def _category_counts(self, condition):
+        facets = self.filter(ad_count__gt=0)
+        if condition:
+            facets = facets.filter(condition=condition)
+        return facets.values_list('category').annotate(total=Sum('ad_count')).order_by('category')
+
+    def _condition_counts(self, category):
+        facets = self.filter(ad_count__gt=0)
+        if category:
+            facets = facets.filter(category=category)
+        return facets.values_list('condition').annotate(total=Sum('ad_count')).order_by()
+
+    def category_counts(self, condition=''):
+        return list(self._category_counts(condition))
+
+    def condition_counts(self, category=''):
+        return dict(self._condition_counts(category))
+
+    async def acategory_counts(self, condition=''):
+        return [row async for row in self._category_counts(condition)]
+
+    async def acondition_counts(self, category=''):
+        return {key: value async for key, value in self._condition_counts(category)}
+
+
+class AdFacet(models.Model):
+    # Материализованные счётчики объявлений по категории и состоянию
+    category = models.CharField(max_length=100)
+    condition = models.CharField(max_length=10, choices=Ad.condition_choices)
+    ad_count = models.IntegerField(default=0)
+
+    objects = AdFacetManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'condition'], name='ad_facet_unique'),
+        ]
+
+
+class UserAdCounterManager(CounterManager):
+    key_fields = ('user_id',)
+    count_field = 'ad_count'
+
+    def rebuild(self):
+        rows = Ad.objects.values_list('user').annotate(total=Count('id')).order_by()
+        with transaction.atomic(using=self.db):
+            self.all().delete()
+            self.bulk_create(UserAdCounter(user_id=user_id, ad_count=total) for user_id, total in rows)
+
+    def reconcile(self, chunk_size=1000):
+        # Пересчёт по диапазонам id пользователей; возвращает число исправленных строк
+        fixed = 0
+        last = User.objects.using(self.db).order_by('-pk').values_list('pk', flat=True).first() or 0
+        for start in range(0, last, chunk_size):
+            end = start + chunk_size
+            with transaction.atomic(using=self.db):
+                actual = dict(
+                    Ad.objects.using(self.db).filter(user__gt=start, user__lte=end)
+                    .values_list('user').annotate(total=Count('id')).order_by()
+                )
+                stored = dict(self.filter(user__gt=start, user__lte=end).values_list('user', 'ad_count'))
+                stale = [
+                    UserAdCounter(user_id=user_id, ad_count=actual.get(user_id, 0))
+                    for user_id in actual.keys() | stored.keys()
+                    if actual.get(user_id, 0) != stored.get(user_id, 0)
+                ]
+                self.bulk_create(stale, update_conflicts=True, unique_fields=['user'], update_fields=['ad_count'])
+                fixed += len(stale)
+        return fixed
+
+
+class UserAdCounter(models.Model):
+    # Материализованное число объявлений пользователя
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='ad_counter')
+    ad_count = models.IntegerField(default=0)
+
+    objects = UserAdCounterManager()
 
 
 class ExchangeProposal(models.Model):
@@ -23,7 +307,220 @@ class ExchangeProposal(models.Model):
     ]
     ad_sender = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name='sent_proposals')
     ad_receiver = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name='received_proposals')
+    # Владельцы объявлений (копия ad_sender.user/ad_receiver.user): входящие и исходящие
+    # пользователя читаются по индексу без соединения с объявлениями
+    sender_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='outbox_proposals', editable=False)
+    receiver_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inbox_proposals', editable=False)
     comment = models.TextField()
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ad_receiver', 'status', 'created_at'], name='proposal_receiver_idx'),
+            models.Index(fields=['ad_sender', 'status', 'created_at'], name='proposal_sender_idx'),
+            # Инкрементальная выгрузка по (created_at, id)
+            models.Index(fields=['created_at'], name='proposal_created_idx'),
+            # Входящие/исходящие пользователя, с фильтром по статусу и без
+            models.Index(fields=['receiver_user', 'created_at'], name='proposal_inbox_idx'),
+            models.Index(fields=['receiver_user', 'status', 'created_at'], name='proposal_inbox_status_idx'),
+            models.Index(fields=['sender_user', 'created_at'], name='proposal_outbox_idx'),
+            models.Index(fields=['sender_user', 'status', 'created_at'], name='proposal_outbox_status_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Исходные ключи счётчиков для пересчёта при сохранении
+        if {'status', 'sender_user_id', 'receiver_user_id', 'ad_sender_id', 'ad_receiver_id'}.issubset(field_names):
+            instance._loaded_counters = instance.counter_keys
+            instance._loaded_edge = instance.desire_edge
+            instance._loaded_ad_counters = instance.ad_counter_keys
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Владельцы берутся из объявлений при создании и при смене объявления
+        for ad, owner in (('ad_sender', 'sender_user_id'), ('ad_receiver', 'receiver_user_id')):
+            if getattr(self, owner) is None or self._meta.get_field(ad).is_cached(self):
+                setattr(self, owner, getattr(self, ad).user_id)
+        super().save(*args, **kwargs)
+
+    @property
+    def counter_keys(self):
+        return (self.receiver_user_id, 'inbox', self.status), (self.sender_user_id, 'outbox', self.status)
+
+    @property
+    def desire_edge(self):
+        # Ожидающее предложение - ребро графа желаний: отправитель хочет вещь получателя
+        return desire_edge_key(self.sender_user_id, self.receiver_user_id, self.status)
+
+    @property
+    def ad_counter_keys(self):
+        return ad_counter_keys(self.ad_sender_id, self.ad_receiver_id, self.status)
+
+
+def desire_edge_key(sender, receiver, status):
+    if status != 'pending' or sender == receiver:
+        return None
+    return sender, receiver
+
+
+def ad_counter_keys(ad_sender, ad_receiver, status):
+    # Ключи Ad.objects.adjust, в которые входит предложение
+    keys = [(ad_receiver, 'received_count'), (ad_sender, 'sent_count')]
+    if status == 'pending':
+        keys.append((ad_receiver, 'pending_count'))
+    return keys
+
+
+class ProposalCounterManager(CounterManager):
+    key_fields = ('user_id', 'box', 'status')
+    count_field = 'proposal_count'
+
+    def rebuild(self):
+        counters = []
+        for box, owner in (('inbox', 'receiver_user'), ('outbox', 'sender_user')):
+            rows = ExchangeProposal.objects.values_list(owner, 'status').annotate(total=Count('id')).order_by()
+            counters += [
+                ProposalCounter(user_id=user_id, box=box, status=status, proposal_count=total)
+                for user_id, status, total in rows
+            ]
+        with transaction.atomic(using=self.db):
+            self.all().delete()
+            self.bulk_create(counters)
+
+    def _counts(self, user):
+        return self.filter(user=user).values_list('box', 'status', 'proposal_count')
+
+    @staticmethod
+    def _group(rows):
+        # {'inbox': {статус: n}, 'outbox': {...}} с нулями для статусов без строк
+        counts = {box: {status: 0 for status, _ in ExchangeProposal.STATUS_CHOICES} for box in ProposalCounter.BOXES}
+        for box, status, total in rows:
+            if status in counts[box]:
+                counts[box][status] = total
+        for box in counts.values():
+            box['total'] = sum(box.values())
+        return counts
+
+    def counts(self, user):
+        return self._group(self._counts(user))
+
+    async def acounts(self, user):
+        return self._group([row async for row in self._counts(user)])
+
+
+class ProposalCounter(models.Model):
+    # Материализованные счётчики предложений пользователя по ящику и статусу
+    BOXES = ('inbox', 'outbox')
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='proposal_counters')
+    box = models.CharField(max_length=6, choices=[(box, box) for box in BOXES])
+    status = models.CharField(max_length=10, choices=ExchangeProposal.STATUS_CHOICES)
+    proposal_count = models.IntegerField(default=0)
+
+    objects = ProposalCounterManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'box', 'status'], name='proposal_counter_unique'),
+        ]
+
+
+class DesireEdgeManager(CounterManager):
+    key_fields = ('from_user_id', 'to_user_id')
+    count_field = 'proposal_count'
+
+    def rebuild(self):
+        rows = ExchangeProposal.objects.filter(status='pending').exclude(sender_user=F('receiver_user')).values_list(
+            'sender_user', 'receiver_user',
+        ).annotate(total=Count('id')).order_by()
+        with transaction.atomic(using=self.db):
+            self.all().delete()
+            self.bulk_create(
+                DesireEdge(from_user_id=sender, to_user_id=receiver, proposal_count=total)
+                for sender, receiver, total in rows
+            )
+
+    def adjusted(self, deltas):
+        # Появившиеся рёбра - поиск новых цепочек, исчезнувшие - удаление цепочек с ними
+        from .matching import edges_changed
+        edges_changed(deltas, using=self.db)
+
+
+class DesireEdge(models.Model):
+    # Граф желаний: from_user хочет вещь to_user (число ожидающих предложений между ними)
+    from_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    proposal_count = models.IntegerField(default=0)
+
+    objects = DesireEdgeManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['from_user', 'to_user'], name='desire_edge_unique'),
+        ]
+        indexes = [
+            # Обратный обход: кто хочет вещи пользователя
+            models.Index(fields=['to_user', 'from_user'], name='desire_edge_reverse_idx'),
+        ]
+
+
+class BarterChain(models.Model):
+    # Найденный цикл обмена: участники по порядку в BarterChainMember
+    key = models.CharField(max_length=255, unique=True)
+    length = models.PositiveSmallIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='chain_created_idx'),
+        ]
+
+
+class BarterChainMember(models.Model):
+    # Шаг цепочки: user хочет вещь next_user
+    chain = models.ForeignKey(BarterChain, on_delete=models.CASCADE, related_name='members')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    next_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    position = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'chain'], name='chain_member_user_idx'),
+            # Удаление цепочек по исчезнувшему ребру
+            models.Index(fields=['user', 'next_user'], name='chain_member_edge_idx'),
+        ]
+
+
+class Job(models.Model):
+    # Фоновая задача: task - путь к функции, args - её аргументы (JSON).
+    # Исполнитель берёт задачу на время аренды (locked_until); если он не успел
+    # завершить её к этому времени, задачу может взять другой исполнитель.
+    STATUS_CHOICES = [
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Выполнена'),
+        ('failed', 'Ошибка'),
+    ]
+    task = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    # Ключ идемпотентности: повторная постановка с тем же ключом возвращает существующую задачу
+    key = models.CharField(max_length=255, null=True, blank=True, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Готовые к выполнению и задачи с истёкшей арендой
+            models.Index(fields=['status', 'run_at'], name='job_ready_idx'),
+            models.Index(fields=['status', 'locked_until'], name='job_lease_idx'),
+        ]
@@ -0,0 +1,208 @@
+import base64
+import binascii
+import datetime
+import json
+from collections.abc import Sequence
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, PageNotAnInteger
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Курсорная (keyset) пагинация: вместо OFFSET страница начинается
+# со строки, следующей за курсором, по ключу сортировки + id.
+# Запрос к глубокой странице стоит столько же, сколько к первой, COUNT не нужен.
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage(Sequence):
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, per_page):
+        ordering = list(queryset.query.order_by)
+        if not ordering:
+            raise ValueError('KeysetPaginator requires an ordered queryset.')
+        # id в конце делает ключ уникальным
+        if ordering[-1].lstrip('-') not in ('id', 'pk'):
+            ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = ordering
+        self.per_page = per_page
+
+    def get_page(self, cursor=None):
+        values, reverse, queryset = self._page_queryset(cursor)
+        return self._build_page(list(queryset), values, reverse)
+
+    async def aget_page(self, cursor=None):
+        values, reverse, queryset = self._page_queryset(cursor)
+        return self._build_page([obj async for obj in queryset], values, reverse)
+
+    def _page_queryset(self, cursor):
+        queryset = self.queryset
+        values, reverse = self.decode_cursor(cursor) if cursor else (None, False)
+        if values is not None:
+            queryset = queryset.filter(self._after(values, reverse))
+        if reverse:
+            queryset = queryset.reverse()
+        return values, reverse, queryset[:self.per_page + 1]
+
+    def _build_page(self, object_list, values, reverse):
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if reverse:
+            object_list.reverse()
+        next_cursor = previous_cursor = None
+        if object_list:
+            if has_more or reverse:
+                next_cursor = self.encode_cursor(object_list[-1], reverse=False)
+            if (has_more and reverse) or (values is not None and not reverse):
+                previous_cursor = self.encode_cursor(object_list[0], reverse=True)
+        return KeysetPage(object_list, next_cursor, previous_cursor)
+
+    def _after(self, values, reverse):
+        # Лексикографическое сравнение (a, b, ...) > (va, vb, ...) с учётом направлений
+        condition = Q()
+        equal = Q()
+        for name, value in zip(self.ordering, values):
+            field = name.lstrip('-')
+            descending = name.startswith('-') != reverse
+            condition |= equal & Q(**{'%s__%s' % (field, 'lt' if descending else 'gt'): value})
+            equal &= Q(**{field: value})
+        # Избыточное условие по первому полю позволяет использовать индекс как диапазон
+        first = self.ordering[0]
+        bound = Q(**{'%s__%s' % (first.lstrip('-'), 'lte' if first.startswith('-') != reverse else 'gte'): values[0]})
+        return bound & condition
+
+    def encode_cursor(self, obj, reverse):
+        values = []
+        for name in self.ordering:
+            # obj - экземпляр модели или словарь из values()
+            value = obj[name.lstrip('-')] if isinstance(obj, dict) else getattr(obj, name.lstrip('-'))
+            if isinstance(value, (datetime.date, datetime.datetime)):
+                value = value.isoformat()
+            values.append(value)
+        payload = json.dumps({'v': values, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            values, reverse = payload['v'], bool(payload['r'])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise InvalidCursor(cursor)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidCursor(cursor)
+        model = self.queryset.model
+        try:
+            for i, name in enumerate(self.ordering):
+                try:
+                    field = model._meta.get_field(name.lstrip('-'))
+                except FieldDoesNotExist:
+                    # Аннотации (например, search_rank) передаются как есть
+                    continue
+                values[i] = field.to_python(values[i])
+        except ValidationError:
+            raise InvalidCursor(cursor)
+        return values, reverse
+
+
+async def aget_page(paginator, number):
+    # Асинхронный аналог Paginator.get_page: acount() и асинхронная выборка страницы
+    paginator.count = await paginator.object_list.acount()
+    try:
+        number = paginator.validate_number(number)
+    except PageNotAnInteger:
+        number = 1
+    except EmptyPage:
+        number = paginator.num_pages
+    bottom = (number - 1) * paginator.per_page
+    top = bottom + paginator.per_page
+    object_list = [obj async for obj in paginator.object_list[bottom:top]]
+    return paginator._get_page(object_list, number, paginator)
+
+
+class KeysetPagination(BasePagination):
+    # Курсорная пагинация для DRF: page_size записей, ссылки next/previous
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 10
+    max_page_size = 100
+
+    def get_page_size(self, size):
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_paginator(self, queryset, request):
+        # Работает и с запросом DRF, и с обычным HttpRequest (асинхронные представления)
+        params = getattr(request, 'query_params', request.GET)
+        self.request = request
+        size = params.get(self.page_size_query_param)
+        return KeysetPaginator(queryset, self.get_page_size(size)), params.get(self.cursor_query_param) or None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        paginator, cursor = self.get_paginator(queryset, request)
+        try:
+            self.page = paginator.get_page(cursor)
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return list(self.page)
+
+    async def apaginate_queryset(self, queryset, request):
+        paginator, cursor = self.get_paginator(queryset, request)
+        try:
+            self.page = await paginator.aget_page(cursor)
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return list(self.page)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.page.next_cursor),
+            'previous': self.get_link(self.page.previous_cursor),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,106 @@
+from collections import Counter
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .events import publish_proposals
+from .models import Ad, DesireEdge, ExchangeProposal, ProposalCounter, ad_counter_keys, desire_edge_key
+from .sqlite import retry_on_lock
+
+# Смена статуса предложения (сайт и /api/proposals/<id>/). Решение по ожидающему
+# предложению окончательное: pending -> accepted или rejected. Статус меняется
+# условным UPDATE ... WHERE status = 'pending', поэтому из двух одновременных
+# решений по одному предложению проходит одно. Принятие в той же транзакции
+# отклоняет одним UPDATE все остальные ожидающие предложения с обоими
+# объявлениями: вещи уже обещаны в этом обмене.
+
+TRANSITIONS = {
+    'pending': ('accepted', 'rejected'),
+    'accepted': (),
+    'rejected': (),
+}
+
+
+class TransitionError(Exception):
+    # Переход из текущего статуса не разрешён (в том числе если его опередило другое решение)
+    def __init__(self, current, status):
+        super().__init__('Нельзя сменить статус предложения с "%s" на "%s"' % (current, status))
+        self.current = current
+        self.status = status
+
+
+class TransitionResult:
+    def __init__(self, proposal, changed, rejected=()):
+        self.proposal = proposal
+        # False - предложение уже было в этом статусе (повторный запрос)
+        self.changed = changed
+        # Конкурирующие предложения, отклонённые вместе с принятием
+        self.rejected = list(rejected)
+
+
+def competing(proposal):
+    # Другие ожидающие предложения с любым из двух объявлений
+    ads = {proposal.ad_sender_id, proposal.ad_receiver_id}
+    return ExchangeProposal.objects.filter(
+        Q(ad_sender__in=ads) | Q(ad_receiver__in=ads), status='pending',
+    ).exclude(pk=proposal.pk)
+
+
+@retry_on_lock
+def change_status(pk, status):
+    # TransitionResult; ExchangeProposal.DoesNotExist, если предложения нет
+    proposal = ExchangeProposal.objects.get(pk=pk)
+    if status == proposal.status:
+        return TransitionResult(proposal, changed=False)
+    check_transition(proposal.status, status)
+    now = timezone.now()
+    if not ExchangeProposal.objects.filter(pk=pk, status=proposal.status).update(status=status, updated_at=now):
+        # Решение по предложению успели принять параллельно
+        current = ExchangeProposal.objects.filter(pk=pk).values_list('status', flat=True).first()
+        if current is None:
+            raise ExchangeProposal.DoesNotExist
+        if current == status:
+            return TransitionResult(ExchangeProposal.objects.get(pk=pk), changed=False)
+        raise TransitionError(current, status)
+    previous = proposal.status
+    proposal.status, proposal.updated_at = status, now
+    rejected = []
+    if status == 'accepted':
+        # После принятия, в той же транзакции: ожидающие конкуренты читаются
+        # с блокировкой строк (в SQLite запись базы уже заблокирована этим UPDATE),
+        # и отклоняются ровно они - счётчики и уведомления для тех же строк
+        rejected = list(competing(proposal).select_for_update().order_by('pk'))
+        if rejected:
+            ExchangeProposal.objects.filter(pk__in=[other.pk for other in rejected], status='pending').update(
+                status='rejected', updated_at=now,
+            )
+            for other in rejected:
+                other.status, other.updated_at = 'rejected', now
+    # UPDATE не отправляет сигналы: счётчики, граф желаний и уведомления - здесь
+    changes = [(proposal, previous)] + [(other, 'pending') for other in rejected]
+    adjust_counters(changes)
+    publish_proposals([proposal, *rejected], 'status')
+    return TransitionResult(proposal, changed=True, rejected=rejected)
+
+
+def check_transition(current, status):
+    if status not in TRANSITIONS.get(current, ()):
+        raise TransitionError(current, status)
+
+
+def adjust_counters(changes):
+    # changes: [(предложение с новым статусом, прежний статус)]
+    deltas, edges, ad_deltas = Counter(), Counter(), Counter()
+    for proposal, previous in changes:
+        deltas.subtract([(proposal.receiver_user_id, 'inbox', previous), (proposal.sender_user_id, 'outbox', previous)])
+        deltas.update(proposal.counter_keys)
+        edges.subtract(filter(None, [desire_edge_key(proposal.sender_user_id, proposal.receiver_user_id, previous)]))
+        edges.update(filter(None, [proposal.desire_edge]))
+        ad_deltas.subtract(ad_counter_keys(proposal.ad_sender_id, proposal.ad_receiver_id, previous))
+        ad_deltas.update(proposal.ad_counter_keys)
+        proposal._loaded_counters = proposal.counter_keys
+        proposal._loaded_edge = proposal.desire_edge
+        proposal._loaded_ad_counters = proposal.ad_counter_keys
+    ProposalCounter.objects.adjust(deltas)
+    DesireEdge.objects.adjust(edges)
+    Ad.objects.adjust(ad_deltas)
@@ -0,0 +1,87 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+# Учёт SQL-запросов на время обработки запроса: число, суммарное время
+# и самый медленный запрос. Работает через execute_wrapper, поэтому
+# не зависит от DEBUG и connection.queries.
+
+logger = logging.getLogger('ads.query_stats')
+
+
+class QueryStats:
+    def __init__(self, using=None):
+        self.aliases = [using] if using else list(connections)
+        self.queries = []
+        self.time = 0.0
+        self.slowest = None
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries.append((sql, duration))
+            self.time += duration
+            if self.slowest is None or duration > self.slowest[1]:
+                self.slowest = (sql, duration)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in self.aliases:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+
+class QueryStatsMiddleware:
+    # Запросы потоковых ответов (StreamingHttpResponse) выполняются
+    # уже после middleware и в статистику не попадают
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with QueryStats() as stats:
+            response = self.get_response(request)
+        return self.report(request, response, stats)
+
+    async def __acall__(self, request):
+        # В async-режиме ORM работает в потоке sync_to_async (один на запрос),
+        # у которого своё соединение: execute_wrapper ставится там же
+        stats = QueryStats()
+        await sync_to_async(stats.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stats.__exit__)(None, None, None)
+        return self.report(request, response, stats)
+
+    def report(self, request, response, stats):
+        if getattr(settings, 'ADS_QUERY_STATS_HEADERS', settings.DEBUG):
+            response['X-DB-Queries'] = str(stats.count)
+            response['X-DB-Time'] = '%.1f' % (stats.time * 1000)
+        if stats.slowest is not None and logger.isEnabledFor(logging.INFO):
+            logger.info(
+                '%s %s: %d queries, %.1f ms; slowest %.1f ms: %s',
+                request.method, request.get_full_path(), stats.count, stats.time * 1000,
+                stats.slowest[1] * 1000, stats.slowest[0],
+            )
+        return response
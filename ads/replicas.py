@@ -0,0 +1,137 @@
+import random
+import sqlite3
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Реплики для чтения. Запросы GET/HEAD/OPTIONS читают из одной из реплик
+# ADS_DB_REPLICAS (алиасы DATABASES), всё остальное - из основной базы.
+# Пользователь, который что-то записал, ADS_DB_PIN_SECONDS секунд читает
+# только основную базу (cookie с временем окончания): свои изменения он видит
+# сразу, даже если реплика ещё не догнала. Вне запросов (команды, фоновые
+# задачи) чтение всегда идёт из основной базы.
+#
+# Для SQLite реплика - копия файла основной базы, которую обновляет команда
+# sync_replicas (онлайн-копирование через backup API).
+
+PIN_COOKIE = 'ads_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = ContextVar('ads_replica_state', default=None)
+
+
+def replica_aliases():
+    return getattr(settings, 'ADS_DB_REPLICAS', [])
+
+
+def primary_apps():
+    # Сессии и пользователи читаются из основной базы: иначе только что вошедший
+    # или зарегистрированный пользователь не найдётся в отстающей реплике
+    return getattr(settings, 'ADS_DB_PRIMARY_APPS', ('sessions', 'auth', 'contenttypes'))
+
+
+class RoutingState:
+    def __init__(self, primary):
+        self.primary = primary
+        self.replica = None
+        self.wrote = False
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        replicas = replica_aliases()
+        if state is None or state.primary or not replicas or model._meta.app_label in primary_apps():
+            return None
+        # Весь запрос читает одну реплику: данные согласованы между собой
+        if state.replica is None:
+            state.replica = random.choice(replicas)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        # После записи запрос дочитывает из основной базы
+        state = _state.get()
+        if state is not None:
+            state.primary = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик приходит вместе с копией основной базы
+        if db in replica_aliases():
+            return False
+        return None
+
+
+def pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaMiddleware:
+    # Состояние маршрутизации - в ContextVar: sync_to_async копирует контекст,
+    # поэтому роутер видит его и в async-режиме
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(primary=request.method not in SAFE_METHODS or pinned(request))
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.pin(response, state)
+
+    async def __acall__(self, request):
+        state = RoutingState(primary=request.method not in SAFE_METHODS or pinned(request))
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.pin(response, state)
+
+    def pin(self, response, state):
+        if state.wrote and replica_aliases():
+            seconds = getattr(settings, 'ADS_DB_PIN_SECONDS', 15)
+            response.set_cookie(PIN_COOKIE, '%.3f' % (time.time() + seconds), max_age=seconds,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+def sync_replica(alias, source=DEFAULT_DB_ALIAS):
+    # Онлайн-копия SQLite через backup API: читатели реплики видят либо старую, либо новую версию
+    source_connection = connections[source]
+    if source_connection.vendor != 'sqlite' or connections[alias].vendor != 'sqlite':
+        raise ValueError('File-copy replicas are supported for SQLite only')
+    source_connection.ensure_connection()
+    target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+    try:
+        source_connection.connection.backup(target)
+    finally:
+        target.close()
+
+
+def sync_replicas(aliases=None):
+    aliases = replica_aliases() if aliases is None else aliases
+    for alias in aliases:
+        sync_replica(alias)
+    return aliases
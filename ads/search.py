@@ -0,0 +1,127 @@
+import re
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Ad
+
+# Полнотекстовый поиск по объявлениям.
+# Бэкенд выбирается настройкой ADS_SEARCH_BACKEND (путь к классу),
+# по умолчанию - по типу базы данных.
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+class BaseSearchBackend:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self, rebuild=False):
+        # Создание индекса (вызывается из миграции и после migrate)
+        pass
+
+    def uninstall(self):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, queryset, query):
+        # Возвращает queryset, отфильтрованный по запросу и размеченный
+        # полем search_rank (чем меньше, тем релевантнее)
+        raise NotImplementedError
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    # Запасной вариант для баз без полнотекстового индекса
+    def search(self, queryset, query):
+        condition = Q()
+        for token in TOKEN_RE.findall(query):
+            condition &= Q(title__icontains=token) | Q(description__icontains=token)
+        return queryset.filter(condition).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    # Внешняя FTS5-таблица поверх ads_ad, синхронизируется триггерами,
+    # поэтому индекс обновляется и при save/delete, и при bulk_create/update.
+    table = Ad._meta.db_table
+    fts_table = '%s_fts' % Ad._meta.db_table
+    columns = ('title', 'description', 'category')
+    # Веса bm25 для title, description, category
+    weights = (10.0, 1.0, 5.0)
+
+    def install(self, rebuild=False):
+        columns = ', '.join(self.columns)
+        new_values = ', '.join('new.%s' % c for c in self.columns)
+        old_values = ', '.join('old.%s' % c for c in self.columns)
+        statements = [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            "{columns}, content='{table}', content_rowid='id', tokenize='unicode61')",
+            # Триггеры пересоздаются после каждой миграции: SQLite теряет их,
+            # когда Django пересоздаёт таблицу ads_ad при изменении схемы.
+            "CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            "INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); END",
+            "CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            "INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old}); END",
+            "CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {columns} ON {table} BEGIN "
+            "INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old}); "
+            "INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); END",
+        ]
+        with self.connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement.format(
+                    fts=self.fts_table, table=self.table, columns=columns,
+                    new=new_values, old=old_values,
+                ))
+        if rebuild:
+            self.rebuild()
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute('DROP TRIGGER IF EXISTS %s_%s' % (self.fts_table, suffix))
+            cursor.execute('DROP TABLE IF EXISTS %s' % self.fts_table)
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=self.fts_table))
+
+    def build_match(self, query):
+        # Каждое слово - префиксный поиск, слова объединяются через AND
+        return ' '.join('"%s"*' % token for token in TOKEN_RE.findall(query))
+
+    def search(self, queryset, query):
+        match = self.build_match(query)
+        if not match:
+            return queryset.none()
+        rank_sql = 'SELECT bm25({fts}, {weights}) FROM {fts} WHERE {fts} MATCH %s AND rowid = {table}.id'.format(
+            fts=self.fts_table, table=self.table,
+            weights=', '.join(str(w) for w in self.weights),
+        )
+        return queryset.filter(
+            id__in=RawSQL('SELECT rowid FROM %s WHERE %s MATCH %%s' % (self.fts_table, self.fts_table), (match,))
+        ).annotate(search_rank=RawSQL(rank_sql, (match,), output_field=FloatField()))
+
+
+def get_search_backend(using=None):
+    conn = connections[using] if using else connection
+    path = getattr(settings, 'ADS_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)(conn)
+    if conn.vendor == 'sqlite':
+        return SQLiteFTSBackend(conn)
+    return SimpleSearchBackend(conn)
+
+
+def search_ads(queryset, query):
+    return get_search_backend(queryset.db).search(queryset, query)
+
+
+def install_search_index(sender, using, **kwargs):
+    # Обработчик post_migrate
+    get_search_backend(using).install()
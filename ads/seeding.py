@@ -0,0 +1,119 @@
+import datetime
+import itertools
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .matching import rebuild_chains
+from .models import Ad, AdFacet, DesireEdge, ExchangeProposal, ProposalCounter, UserAdCounter
+
+# Генерация синтетических данных для нагрузочных замеров.
+# Распределения неравномерные, как в живой базе: несколько категорий
+# занимают большую часть объявлений (закон Ципфа), б/у товаров больше,
+# чем новых, большинство предложений ожидает ответа.
+
+CATEGORIES = [
+    'Electronics', 'Books', 'Clothes', 'Home', 'Sport', 'Kids', 'Auto', 'Garden',
+    'Music', 'Games', 'Tools', 'Beauty', 'Pets', 'Art', 'Collectibles', 'Other',
+]
+CONDITIONS = [('used', 0.7), ('new', 0.3)]
+STATUSES = [('pending', 0.6), ('rejected', 0.25), ('accepted', 0.15)]
+WORDS = [
+    'телефон', 'ноутбук', 'велосипед', 'книга', 'куртка', 'диван', 'лампа', 'гитара',
+    'кроссовки', 'игрушка', 'коляска', 'дрель', 'самокат', 'монитор', 'чайник', 'рюкзак',
+    'почти', 'новый', 'отличный', 'рабочий', 'старый', 'красный', 'большой', 'маленький',
+    'обмен', 'срочно', 'торг', 'состояние', 'комплект', 'гарантия', 'зарядка', 'коробка',
+]
+BATCH_SIZE = 5000
+
+
+def zipf_weights(n, s=1.1):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def _set_timestamps(model, objects, timestamps):
+    # auto_now_add/auto_now перезаписывают created_at и updated_at при вставке;
+    # для реалистичного разброса дат они выставляются вторым запросом:
+    # bulk_update не вызывает pre_save, метаданные полей не трогаются
+    for obj, value in zip(objects, timestamps):
+        obj.created_at = obj.updated_at = value
+    model.objects.bulk_update(objects, ['created_at', 'updated_at'])
+
+
+def _batches(iterable, size=BATCH_SIZE):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def _timestamps(rng, count, days):
+    now = timezone.now()
+    span = days * 24 * 3600
+    for _ in range(count):
+        yield now - datetime.timedelta(seconds=rng.random() * span)
+
+
+def seed(users=100, ads=1000, proposals=500, seed=0, days=365, stdout=None):
+    rng = random.Random(seed)
+    password = make_password('password')
+    start = User.objects.count()
+
+    def log(message):
+        if stdout is not None:
+            stdout.write(message)
+
+    with transaction.atomic():
+        for batch in _batches(range(start, start + users)):
+            User.objects.bulk_create(
+                User(username='seed_user_%d' % n, password=password) for n in batch
+            )
+        user_ids = list(User.objects.values_list('id', flat=True))
+        log('Пользователей: %d' % len(user_ids))
+
+        category_weights = zipf_weights(len(CATEGORIES))
+        conditions, condition_weights = zip(*CONDITIONS)
+        created = sorted(_timestamps(rng, ads, days))
+        for batch in _batches(range(ads)):
+            rows = Ad.objects.bulk_create(
+                Ad(
+                    title=' '.join(rng.choices(WORDS[:16], k=1) + rng.choices(WORDS[16:], k=2)).capitalize(),
+                    description=' '.join(rng.choices(WORDS, k=rng.randint(8, 40))),
+                    category=rng.choices(CATEGORIES, category_weights)[0],
+                    condition=rng.choices(conditions, condition_weights)[0],
+                    user_id=rng.choice(user_ids),
+                )
+                for n in batch
+            )
+            _set_timestamps(Ad, rows, [created[n] for n in batch])
+        log('Объявлений: %d' % ads)
+
+        ad_owners = list(Ad.objects.values_list('id', 'user_id'))
+        statuses, status_weights = zip(*STATUSES)
+        created = sorted(_timestamps(rng, proposals, days))
+        if len({owner for _, owner in ad_owners}) > 1:
+            for batch in _batches(range(proposals)):
+                rows = []
+                for n in batch:
+                    sender, receiver = rng.sample(ad_owners, 2)
+                    while sender[1] == receiver[1]:
+                        sender, receiver = rng.sample(ad_owners, 2)
+                    rows.append(ExchangeProposal(
+                        ad_sender_id=sender[0], ad_receiver_id=receiver[0],
+                        sender_user_id=sender[1], receiver_user_id=receiver[1],
+                        comment=' '.join(rng.choices(WORDS, k=6)),
+                        status=rng.choices(statuses, status_weights)[0],
+                    ))
+                ExchangeProposal.objects.bulk_create(rows)
+                _set_timestamps(ExchangeProposal, rows, [created[n] for n in batch])
+            log('Предложений: %d' % proposals)
+
+        # bulk_create не отправляет сигналы: пересчитываем счётчики целиком
+        AdFacet.objects.rebuild()
+        ProposalCounter.objects.rebuild()
+        DesireEdge.objects.rebuild()
+        UserAdCounter.objects.rebuild()
+        Ad.objects.reconcile()
+        log('Цепочек обмена: %d' % rebuild_chains())
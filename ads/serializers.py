@@ -1,12 +1,73 @@
 from rest_framework import serializers
-from .models import Ad, ExchangeProposal
+from .models import Ad, BarterChain, ExchangeProposal
+from .thumbnails import thumbnail_url
+
+
+def parse_fields(value, allowed):
+    # ?fields=id,title -> ['id', 'title']; неизвестные поля - ошибка 400
+    if not value:
+        return None
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise serializers.ValidationError({'fields': ['Unknown fields: %s.' % ', '.join(unknown)]})
+    return fields
+
+
+class ThumbnailURLField(serializers.ReadOnlyField):
+    # Ссылка на миниатюру по значению image_url
+    def to_representation(self, value):
+        return thumbnail_url(value)
+
 
 class AdSerializer(serializers.ModelSerializer):
+    thumbnail_url = ThumbnailURLField(source='image_url')
+
     class Meta:
         model = Ad
-        fields = ['id', 'title', 'description', 'image_url', 'category', 'condition']  # Явное указание полей
+        fields = [
+            'id', 'title', 'description', 'image_url', 'thumbnail_url', 'category', 'condition',
+            'received_count', 'sent_count', 'pending_count',
+        ]  # Явное указание полей
 
 class ExchangeProposalSerializer(serializers.ModelSerializer):
+    # Новое предложение всегда ожидает ответа: статус меняется только через
+    # переходы ads.proposals.change_status
     class Meta:
         model = ExchangeProposal
         fields = '__all__'
+        read_only_fields = ['status']
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.instance is not None:
+            # Объявления задаются при создании: от них зависят участники, счётчики и граф желаний
+            for name in ('ad_sender', 'ad_receiver'):
+                fields[name].read_only = True
+        return fields
+
+    def validate_ad_sender(self, ad):
+        request = self.context.get('request')
+        if request is not None and ad.user_id != request.user.pk:
+            raise serializers.ValidationError('You can only offer your own ads.')
+        return ad
+
+
+class BarterChainSerializer(serializers.ModelSerializer):
+    # Шаги цепочки: from_user хочет вещь to_user; proposal - ожидающее предложение между ними
+    steps = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BarterChain
+        fields = ['id', 'length', 'created_at', 'steps']
+
+    def get_steps(self, chain):
+        proposals = self.context.get('proposals', {})
+        steps = []
+        for member in chain.members.all():
+            proposal, ad_sender, ad_receiver = proposals.get((member.user_id, member.next_user_id), (None, None, None))
+            steps.append({
+                'from_user': member.user_id, 'to_user': member.next_user_id,
+                'proposal': proposal, 'ad_sender': ad_sender, 'ad_receiver': ad_receiver,
+            })
+        return steps
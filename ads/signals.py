@@ -0,0 +1,116 @@
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .events import publish_proposals
+from .models import (
+    Ad, AdFacet, BarterChain, DesireEdge, ExchangeProposal, ProposalCounter, UserAdCounter, ad_counter_keys,
+    desire_edge_key,
+)
+from .similar import schedule_refresh, schedule_remove
+from .thumbnails import schedule_thumbnails
+
+
+@receiver(pre_save, sender=Ad)
+def remember_ad_facet(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        instance._previous_facet = None
+    elif hasattr(instance, '_loaded_facet'):
+        instance._previous_facet = instance._loaded_facet
+    else:
+        instance._previous_facet = (
+            Ad.objects.filter(pk=instance.pk).values_list('category', 'condition').first()
+        )
+
+
+@receiver(post_save, sender=Ad)
+def update_ad_facets(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = Counter()
+    previous = getattr(instance, '_previous_facet', None)
+    if previous is not None and not created:
+        deltas[previous] -= 1
+    if created or previous is not None:
+        deltas[instance.facet_key] += 1
+    AdFacet.objects.adjust(deltas)
+    if created:
+        UserAdCounter.objects.adjust({(instance.user_id,): 1})
+    instance._loaded_facet = instance.facet_key
+    schedule_refresh([instance.pk])
+    schedule_thumbnails([instance.image_url])
+
+
+@receiver(pre_delete, sender=Ad)
+def remember_deleted_ad_facet(sender, instance, **kwargs):
+    # До удаления: у отложенных (.only) полей ещё можно дочитать значения
+    instance._deleted_facet = getattr(instance, '_loaded_facet', None) or instance.facet_key
+
+
+@receiver(post_delete, sender=Ad)
+def remove_ad_facet(sender, instance, **kwargs):
+    AdFacet.objects.adjust({instance._deleted_facet: -1})
+    UserAdCounter.objects.adjust({(instance.user_id,): -1})
+    schedule_remove([instance.pk])
+
+
+@receiver(pre_save, sender=ExchangeProposal)
+def remember_proposal_counters(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        instance._previous_counters = instance._previous_edge = instance._previous_ad_counters = None
+    elif hasattr(instance, '_loaded_counters'):
+        instance._previous_counters = instance._loaded_counters
+        instance._previous_edge = instance._loaded_edge
+        instance._previous_ad_counters = instance._loaded_ad_counters
+    else:
+        row = ExchangeProposal.objects.filter(pk=instance.pk).values_list(
+            'receiver_user', 'sender_user', 'status', 'ad_sender', 'ad_receiver',
+        ).first()
+        instance._previous_counters = row and ((row[0], 'inbox', row[2]), (row[1], 'outbox', row[2]))
+        instance._previous_edge = row and desire_edge_key(row[1], row[0], row[2])
+        instance._previous_ad_counters = row and ad_counter_keys(row[3], row[4], row[2])
+
+
+@receiver(post_save, sender=ExchangeProposal)
+def update_proposal_counters(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    deltas, edges, ad_deltas = Counter(), Counter(), Counter()
+    previous = getattr(instance, '_previous_counters', None)
+    if previous is not None and not created:
+        deltas.subtract(previous)
+        ad_deltas.subtract(instance._previous_ad_counters)
+        if instance._previous_edge:
+            edges[instance._previous_edge] -= 1
+    if created or previous is not None:
+        deltas.update(instance.counter_keys)
+        ad_deltas.update(instance.ad_counter_keys)
+        if instance.desire_edge:
+            edges[instance.desire_edge] += 1
+    ProposalCounter.objects.adjust(deltas)
+    DesireEdge.objects.adjust(edges)
+    Ad.objects.adjust(ad_deltas)
+    # Уведомления отправителю и получателю: новое предложение или смена статуса
+    if created:
+        publish_proposals([instance], 'created')
+    elif previous is not None and previous[0][2] != instance.status:
+        publish_proposals([instance], 'status')
+    instance._loaded_counters = instance.counter_keys
+    instance._loaded_edge = instance.desire_edge
+    instance._loaded_ad_counters = instance.ad_counter_keys
+
+
+@receiver(post_delete, sender=ExchangeProposal)
+def remove_proposal_counters(sender, instance, **kwargs):
+    ProposalCounter.objects.adjust({key: -1 for key in instance.counter_keys})
+    Ad.objects.adjust({key: -1 for key in instance.ad_counter_keys})
+    if instance.desire_edge:
+        DesireEdge.objects.adjust({instance.desire_edge: -1})
+
+
+@receiver(pre_delete, sender=User)
+def remove_user_chains(sender, instance, **kwargs):
+    # Каскад удалил бы только шаги пользователя, а цепочка без участника не имеет смысла
+    BarterChain.objects.filter(members__user=instance).delete()
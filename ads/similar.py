@@ -0,0 +1,421 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .jobs import background_jobs, defer
+from .models import Ad
+from .search import TOKEN_RE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Похожие объявления. Каждое объявление - TF-IDF вектор по словам title/description
+# и категории, свёрнутый хэшированием в dim измерений (без словаря). Для каждого
+# объявления заранее считаются k ближайших по косинусу, индекс лежит на диске
+# в .npy файлах и читается через memmap: строка массива - id объявления, поэтому
+# поиск соседей - чтение одной строки без запросов к базе.
+#
+# Полная сборка - команда build_similar_index. После неё изменения объявлений
+# копятся и применяются к индексу пачкой вне запроса (фоновый поток или задача
+# Job): одно умножение матриц на блок изменённых объявлений даёт и их соседей,
+# и строки, в которые они входят; строки, где они были соседями, находятся одним
+# проходом по массиву соседей. Строка пересчитывается целиком, только если без
+# этого нельзя сохранить точный top-k; большая пачка - пересчёт всех соседей.
+# IDF фиксируется при сборке и до следующей полной сборки не меняется, поэтому
+# индекс стоит периодически пересобирать.
+
+logger = logging.getLogger(__name__)
+# Изменённых объявлений на одно умножение матриц; пачка больше блока и восьмой части
+# индекса пересчитывает всех соседей
+REFRESH_BLOCK = 256
+
+FIELD_WEIGHTS = (('title', 2.0), ('description', 1.0))
+CATEGORY_WEIGHT = 3.0
+# Число корзин для подсчёта документной частоты
+IDF_BUCKETS = 1 << 18
+ARRAYS = ('vectors', 'neighbors', 'scores')
+META_FILE = 'meta.json'
+# Увеличивать при изменении признаков или формата файлов
+INDEX_VERSION = 1
+
+
+def similar_options():
+    return {
+        'path': Path(getattr(settings, 'ADS_SIMILAR_DIR', Path(settings.BASE_DIR) / 'similar_index')),
+        'k': getattr(settings, 'ADS_SIMILAR_TOP_K', 10),
+        'dim': getattr(settings, 'ADS_SIMILAR_DIM', 256),
+    }
+
+
+def _hash(token):
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'little')
+
+
+def features(title, description, category):
+    # {хэш признака: взвешенная частота}
+    tf = Counter()
+    for text, (_, weight) in zip((title, description), FIELD_WEIGHTS):
+        for token in TOKEN_RE.findall((text or '').lower()):
+            tf[_hash(token)] += weight
+    if category:
+        tf[_hash('category:' + category.lower())] += CATEGORY_WEIGHT
+    return tf
+
+
+def document_frequency(rows):
+    # rows: (id, title, description, category) -> (df по корзинам, число объявлений, максимальный id)
+    df = np.zeros(IDF_BUCKETS, np.int64)
+    count = max_id = 0
+    for pk, *fields in rows:
+        buckets = np.unique(np.fromiter(features(*fields), np.uint64) % IDF_BUCKETS)
+        df[buckets.astype(np.int64)] += 1
+        count += 1
+        max_id = max(max_id, pk)
+    return df, count, max_id
+
+
+def make_vector(tf, idf, dim):
+    # Хэшированный TF-IDF: измерение и знак - из старших битов хэша признака
+    vector = np.zeros(dim, np.float32)
+    for feature, weight in tf.items():
+        sign = 1.0 if feature >> 63 else -1.0
+        vector[(feature >> 32) % dim] += sign * (1.0 + math.log(weight)) * idf[feature % IDF_BUCKETS]
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def top_k(scores, k):
+    # (id, сходство) k лучших положительных, по убыванию; недостающие - (-1, 0)
+    neighbors = np.full(k, -1, np.int64)
+    best = np.zeros(k, np.float32)
+    positive = np.flatnonzero(scores > 0)
+    if positive.size > k:
+        positive = positive[np.argpartition(-scores[positive], k - 1)[:k]]
+    positive = positive[np.argsort(-scores[positive], kind='stable')]
+    neighbors[:positive.size] = positive
+    best[:positive.size] = scores[positive]
+    return neighbors, best
+
+
+class SimilarIndex:
+    def __init__(self, path, k=10, dim=256):
+        self.path = Path(path)
+        self.k = k
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._arrays = None
+        self._stamp = None
+
+    @property
+    def available(self):
+        # Индекс собран текущей версией и с текущими k и dim
+        return np is not None and self.load() is not None
+
+    def _file(self, name):
+        return self.path / ('%s.npy' % name)
+
+    def _read_meta(self):
+        with open(self.path / META_FILE) as stream:
+            return json.load(stream)
+
+    def load(self):
+        # Массивы только для чтения; открываются заново после пересборки или расширения
+        try:
+            stamp = (self.path / META_FILE).stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if stamp != self._stamp:
+            meta = self._read_meta()
+            if (meta.get('version'), meta.get('k'), meta.get('dim')) != (INDEX_VERSION, self.k, self.dim):
+                return None
+            self._arrays = {name: np.load(self._file(name), mmap_mode='r') for name in ARRAYS}
+            self._stamp = stamp
+        return self._arrays
+
+    def lookup(self, pk):
+        # [(id, сходство), ...] - одна строка memmap, O(k)
+        if np is None:
+            return []
+        arrays = self.load()
+        if arrays is None or not 0 <= pk < len(arrays['neighbors']):
+            return []
+        return [
+            (int(neighbor), float(score))
+            for neighbor, score in zip(arrays['neighbors'][pk], arrays['scores'][pk]) if neighbor >= 0
+        ]
+
+    @contextmanager
+    def locked(self):
+        # Запись индекса - один поток процесса и один процесс (flock, где он есть)
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(self.path / 'lock', 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_meta(self, **meta):
+        tmp = self.path / (META_FILE + '.tmp')
+        with open(tmp, 'w') as stream:
+            json.dump(dict(meta, version=INDEX_VERSION, k=self.k, dim=self.dim), stream)
+        os.replace(tmp, self.path / META_FILE)
+
+    def _save(self, name, array):
+        # Запись во временный файл и атомарная замена: открытые memmap читают старую копию
+        tmp = self.path / ('%s.tmp.npy' % name)
+        np.save(tmp, array)
+        os.replace(tmp, self._file(name))
+
+    def build(self, queryset=None, chunk_size=2000, block_size=512):
+        # Полная сборка: два прохода по объявлениям (частоты, затем векторы) и блочный поиск соседей
+        if np is None:
+            raise RuntimeError('numpy is required for the similar ads index')
+        queryset = (queryset if queryset is not None else Ad.objects.all()).order_by()
+
+        def rows():
+            return queryset.values_list('id', 'title', 'description', 'category').iterator(chunk_size)
+
+        df, count, max_id = document_frequency(rows())
+        idf = (np.log((1 + count) / (1 + df)) + 1).astype(np.float32)
+        capacity = max(64, (max_id + 1) * 5 // 4)
+        vectors = np.zeros((capacity, self.dim), np.float32)
+        for pk, *fields in rows():
+            vectors[pk] = make_vector(features(*fields), idf, self.dim)
+
+        neighbors = np.full((capacity, self.k), -1, np.int64)
+        scores = np.zeros((capacity, self.k), np.float32)
+        self._fill_neighbors(vectors, neighbors, scores, block_size)
+
+        with self.locked():
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._save('idf', idf)
+            for name, array in zip(ARRAYS, (vectors, neighbors, scores)):
+                self._save(name, array)
+            self._write_meta(ads=count)
+        return count
+
+    def _fill_neighbors(self, vectors, neighbors, scores, block_size=512):
+        # Соседи всех объявлений заново: блочное умножение матриц
+        neighbors[:] = -1
+        scores[:] = 0
+        ids = np.flatnonzero(vectors.any(axis=1))
+        matrix = np.asarray(vectors[ids])
+        for start in range(0, ids.size, block_size):
+            block = ids[start:start + block_size]
+            similarity = matrix[start:start + block_size] @ matrix.T
+            # Объявление не похоже само на себя
+            similarity[np.arange(block.size), np.arange(start, start + block.size)] = -1
+            for row, pk in zip(similarity, block):
+                positions, best = top_k(row, self.k)
+                neighbors[pk] = np.where(positions >= 0, ids[np.maximum(positions, 0)], -1)
+                scores[pk] = best
+
+    def _open_for_write(self, max_pk):
+        # memmap на запись; если id не помещается, файлы расширяются с запасом
+        arrays = {name: np.load(self._file(name), mmap_mode='r+') for name in ARRAYS}
+        capacity = len(arrays['vectors'])
+        if max_pk < capacity:
+            return arrays
+        grown = max(capacity * 2, max_pk + 1)
+        fills = {'vectors': 0, 'neighbors': -1, 'scores': 0}
+        for name, array in arrays.items():
+            bigger = np.full((grown, array.shape[1]), fills[name], array.dtype)
+            bigger[:capacity] = array
+            self._save(name, bigger)
+        self._write_meta(**self._read_meta())
+        return {name: np.load(self._file(name), mmap_mode='r+') for name in ARRAYS}
+
+    def refresh(self, pks):
+        # Объявления изменились, появились или удалены (нет в базе - удаляются из индекса)
+        if not self.available or not pks:
+            return
+        pks = sorted(set(pks))
+        rows = {pk: fields for pk, *fields in Ad.objects.filter(pk__in=pks).values_list(
+            'id', 'title', 'description', 'category',
+        )}
+        with self.locked():
+            idf = np.load(self._file('idf'), mmap_mode='r')
+            arrays = self._open_for_write(pks[-1])
+            for pk in pks:
+                arrays['vectors'][pk] = make_vector(features(*rows[pk]), idf, self.dim) if pk in rows else 0
+            self._reindex(arrays, pks)
+            for array in arrays.values():
+                array.flush()
+
+    def remove(self, pks):
+        # Удалённые объявления: без запроса к базе
+        if not self.available or not pks:
+            return
+        with self.locked():
+            arrays = {name: np.load(self._file(name), mmap_mode='r+') for name in ARRAYS}
+            pks = [pk for pk in set(pks) if pk < len(arrays['vectors'])]
+            for pk in pks:
+                arrays['vectors'][pk] = 0
+            self._reindex(arrays, pks)
+            for array in arrays.values():
+                array.flush()
+
+    def _reindex(self, arrays, changed):
+        # Соседи после изменения векторов changed: точный top-k, как при полной сборке
+        vectors, neighbors, scores = arrays['vectors'], arrays['neighbors'], arrays['scores']
+        changed = np.unique(np.asarray(changed, np.int64))
+        if not changed.size:
+            return
+        block_size = REFRESH_BLOCK
+        if changed.size > max(block_size, len(vectors) // 8):
+            # Большая пачка (импорт): дешевле пересчитать всех соседей за один проход
+            self._fill_neighbors(vectors, neighbors, scores)
+            return
+        is_changed = np.zeros(len(vectors), bool)
+        is_changed[changed] = True
+        # Строки, где изменённые объявления уже были соседями, - один проход по массиву соседей
+        affected = (is_changed[np.maximum(neighbors, 0)] & (neighbors >= 0)).any(axis=1)
+        for start in range(0, changed.size, block_size):
+            block = changed[start:start + block_size]
+            similarity = np.asarray(vectors @ vectors[block].T)
+            similarity[block, np.arange(block.size)] = -1
+            for column, pk in enumerate(block):
+                neighbors[pk], scores[pk] = top_k(similarity[:, column], self.k)
+            # Строки, куда изменённые объявления проходят по сходству, - из того же произведения
+            affected |= (similarity > np.asarray(scores[:, -1])[:, None]).any(axis=1)
+        affected[changed] = False
+        stale = []
+        changed_vectors = np.asarray(vectors[changed])
+        rows = np.flatnonzero(affected)
+        for start in range(0, rows.size, block_size):
+            chunk = rows[start:start + block_size]
+            for row, row_scores in zip(chunk, np.asarray(vectors[chunk]) @ changed_vectors.T):
+                if not self._merge(neighbors, scores, row, changed, row_scores, is_changed):
+                    stale.append(row)
+        # Строки, которым не хватило известных соседей: поиск по всем векторам
+        stale = np.asarray(stale, np.int64)
+        for start in range(0, stale.size, block_size):
+            chunk = stale[start:start + block_size]
+            similarity = np.asarray(vectors[chunk]) @ np.asarray(vectors).T
+            similarity[np.arange(chunk.size), chunk] = -1
+            for row, row_scores in zip(chunk, similarity):
+                neighbors[row], scores[row] = top_k(row_scores, self.k)
+
+    def _merge(self, neighbors, scores, row, changed, changed_scores, is_changed):
+        # Соседи строки из прежних (неизменённых) и изменённых объявлений. False - если
+        # прежних не хватает: остальные объявления не слабее последнего прежнего соседа,
+        # и без полного поиска top-k не восстановить
+        current, current_scores = neighbors[row], scores[row]
+        full = current[-1] >= 0
+        keep = (current >= 0) & ~is_changed[np.maximum(current, 0)]
+        candidates = np.append(current[keep], changed)
+        values = np.append(current_scores[keep], changed_scores)
+        positions, best = top_k(values, self.k)
+        if full and keep.sum() < self.k and (positions[-1] < 0 or best[-1] < current_scores[-1]):
+            return False
+        neighbors[row] = np.where(positions >= 0, candidates[np.maximum(positions, 0)], -1)
+        scores[row] = best
+        return True
+
+
+class SimilarRefresher:
+    # Изменённые объявления копятся и применяются к индексу пачкой в фоновом потоке:
+    # сохранение не ждёт пересчёта, изменения, пришедшие во время прохода, - следующая пачка.
+    # background=False - сразу в вызывающем потоке (тесты)
+    def __init__(self, index, background=True):
+        self.index = index
+        self.background = background
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def schedule(self, pks):
+        if not self.background:
+            self.index.refresh(pks)
+            return
+        with self._lock:
+            self._pending.update(pks)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='similar-refresh', daemon=True)
+                self._thread.start()
+
+    def run(self):
+        try:
+            while True:
+                with self._lock:
+                    pks, self._pending = self._pending, set()
+                    if not pks:
+                        self._thread = None
+                        return
+                try:
+                    self.index.refresh(pks)
+                except Exception:
+                    logger.exception('Similar index refresh failed for %d ads', len(pks))
+        finally:
+            close_old_connections()
+
+
+_indexes = {}
+_refreshers = {}
+
+
+def get_index():
+    options = similar_options()
+    key = tuple(options.values())
+    if key not in _indexes:
+        _indexes[key] = SimilarIndex(**options)
+    return _indexes[key]
+
+
+def get_refresher():
+    index = get_index()
+    background = getattr(settings, 'ADS_SIMILAR_BACKGROUND_REFRESH', True)
+    key = (index, background)
+    if key not in _refreshers:
+        _refreshers[key] = SimilarRefresher(index, background)
+    return _refreshers[key]
+
+
+def similar_ads(ranked):
+    # ranked - результат lookup(); объявления в порядке сходства, одна выборка по первичному ключу
+    ads = Ad.objects.in_bulk([neighbor for neighbor, _ in ranked]) if ranked else {}
+    return [(ads[neighbor], score) for neighbor, score in ranked if neighbor in ads]
+
+
+async def asimilar_ads(ranked):
+    ads = await Ad.objects.ain_bulk([neighbor for neighbor, _ in ranked]) if ranked else {}
+    return [(ads[neighbor], score) for neighbor, score in ranked if neighbor in ads]
+
+
+def schedule_refresh(pks):
+    # После фиксации транзакции (изменения видны в базе) и вне запроса: задачей Job
+    # при ADS_BACKGROUND_JOBS, иначе фоновым потоком. Удалённые объявления refresh
+    # тоже убирает из индекса, поэтому изменения и удаления копятся вместе
+    if not get_index().available:
+        return
+    pks = list(pks)
+    if background_jobs():
+        defer('ads.tasks.refresh_similar', pks)
+    else:
+        refresher = get_refresher()
+        transaction.on_commit(lambda: refresher.schedule(pks))
+
+
+def schedule_remove(pks):
+    schedule_refresh(pks)
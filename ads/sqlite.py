@@ -0,0 +1,94 @@
+import functools
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Продакшен-профиль SQLite (ADS_SQLITE_PRODUCTION): при открытии соединения
+# выставляются ADS_SQLITE_PRAGMAS - WAL (читатели не ждут писателя), synchronous,
+# mmap_size, cache_size, busy_timeout (ожидание блокировки вместо мгновенной
+# ошибки). Соединения переиспользуются (CONN_MAX_AGE в settings), транзакции
+# начинаются с BEGIN IMMEDIATE: блокировка берётся сразу и ожидается по
+# busy_timeout, а не при первой записи, где SQLite отвечает ошибкой без ожидания.
+# Если блокировку так и не дали, пишущие представления повторяются (retry_on_lock).
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+}
+
+LOCK_MESSAGES = ('database is locked', 'database table is locked', 'database schema is locked')
+
+
+def sqlite_pragmas():
+    return getattr(settings, 'ADS_SQLITE_PRAGMAS', DEFAULT_PRAGMAS)
+
+
+def configure_connection(sender, connection, **kwargs):
+    # Обработчик connection_created; базы в памяти (тесты) не трогаются
+    if connection.vendor != 'sqlite' or not getattr(settings, 'ADS_SQLITE_PRODUCTION', False):
+        return
+    if connection.is_in_memory_db():
+        return
+    for name, value in sqlite_pragmas().items():
+        connection.connection.execute('PRAGMA %s = %s' % (name, value))
+
+
+def is_lock_error(exc):
+    return isinstance(exc, OperationalError) and any(message in str(exc) for message in LOCK_MESSAGES)
+
+
+def retry_on_lock(func=None, using=DEFAULT_DB_ALIAS, attempts=None, delay=None):
+    # Каждая попытка - отдельная транзакция: при блокировке всё откатывается и выполняется заново.
+    # Внутри чужой транзакции не повторяет: откатить её часть нельзя
+    if func is None:
+        return functools.partial(retry_on_lock, using=using, attempts=attempts, delay=delay)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = attempts or getattr(settings, 'ADS_SQLITE_LOCK_RETRIES', 3)
+        base = delay if delay is not None else getattr(settings, 'ADS_SQLITE_LOCK_RETRY_DELAY', 0.05)
+        for attempt in range(retries + 1):
+            try:
+                with transaction.atomic(using=using):
+                    return func(*args, **kwargs)
+            except OperationalError as exc:
+                if attempt == retries or not is_lock_error(exc) or connections[using].in_atomic_block:
+                    raise
+                logger.warning('%s: database is locked, retry %d', func.__qualname__, attempt + 1)
+                time.sleep(base * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
+
+
+def retry_writes_on_lock(view):
+    # Для представлений: повторяются только изменяющие запросы, чтение не берёт блокировку записи
+    retrying = retry_on_lock(view)
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return view(request, *args, **kwargs)
+        return retrying(request, *args, **kwargs)
+    return wrapper
+
+
+class LockRetryMixin:
+    # Для ModelViewSet: запись через сериализатор повторяется при блокировке базы
+    @retry_on_lock
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+
+    @retry_on_lock
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+
+    @retry_on_lock
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
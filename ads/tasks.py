@@ -0,0 +1,30 @@
+from .matching import find_new_chains
+from .models import Ad, DesireEdge
+from .similar import get_index
+
+# Функции фоновых задач (Job.task - путь к функции). Аргументы приходят из JSON,
+# а между постановкой и выполнением данные могли измениться, поэтому каждая
+# задача перепроверяет состояние и безопасна при повторном запуске.
+
+
+def delete_ad(pk):
+    # Удаление с каскадом по предложениям; уже удалённое объявление - не ошибка
+    for ad in Ad.objects.filter(pk=pk):
+        ad.delete()
+
+
+def refresh_similar(pks):
+    get_index().refresh(pks)
+
+
+def remove_similar(pks):
+    get_index().remove(pks)
+
+
+def find_chains(edges):
+    # Рёбра, которые ещё есть в графе желаний
+    edges = {tuple(edge) for edge in edges}
+    existing = DesireEdge.objects.filter(
+        proposal_count__gt=0, from_user__in={u for u, _ in edges}, to_user__in={v for _, v in edges},
+    ).values_list('from_user', 'to_user')
+    find_new_chains(sorted(edges & set(existing)))
@@ -0,0 +1,11 @@
+from django import template
+
+from ..card_cache import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def cached_ad_cards(ads):
+    # Список пар (объявление, html карточки) из кэша фрагментов
+    return render_cards(list(ads))
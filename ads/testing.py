@@ -0,0 +1,48 @@
+import logging
+from contextlib import contextmanager
+from functools import wraps
+
+from .query_stats import QueryStats
+
+# Бюджеты SQL-запросов для тестов: в отличие от assertNumQueries
+# проверяется верхняя граница, а при превышении выводятся все запросы.
+
+
+class QueryBudgetMixin:
+    @contextmanager
+    def assertQueryBudget(self, budget, using=None):
+        with QueryStats(using) as stats:
+            yield stats
+        if stats.count > budget:
+            self.fail('%d queries executed, budget is %d:\n%s' % (
+                stats.count, budget, '\n'.join('%d. %s' % (i, sql) for i, (sql, _) in enumerate(stats.queries, 1)),
+            ))
+
+
+def query_budget(budget, using=None):
+    # Декоратор для тестовых методов класса с QueryBudgetMixin
+    def decorator(test):
+        @wraps(test)
+        def wrapper(self, *args, **kwargs):
+            with self.assertQueryBudget(budget, using):
+                return test(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def captured_logs(name, level=logging.WARNING):
+    # Как assertLogs, но без требования хотя бы одной записи: в тестах с потоками
+    # повторы при блокировке базы возможны, но не гарантированы. Записи не выводятся
+    logger = logging.getLogger(name)
+    records = []
+    handler = logging.Handler(level)
+    handler.emit = records.append
+    saved = logger.handlers, logger.propagate, logger.level
+    logger.handlers, logger.propagate = [handler], False
+    logger.setLevel(level)
+    try:
+        yield records
+    finally:
+        logger.handlers, logger.propagate = saved[:2]
+        logger.setLevel(saved[2])
@@ -0,0 +1,348 @@
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Миниатюры для Ad.image_url. Исходная картинка скачивается один раз через
+# подключаемый загрузчик (ADS_THUMBNAIL_FETCHER), миниатюра фиксированного
+# размера строится в фоновом потоке и кладётся в дисковый кэш по хэшу
+# содержимого. Ссылка на миниатюру - подписанный URL источника, поэтому
+# строится без обращения к диску и к базе; пока миниатюры нет, представление
+# перенаправляет на оригинал. Кэш ограничен по размеру, при переполнении
+# удаляются давно не запрашивавшиеся файлы (LRU по времени изменения).
+
+SIGNING_SALT = 'ads.thumbnails'
+# Увеличивать при изменении способа построения миниатюр
+THUMBNAIL_VERSION = 1
+# Время последнего доступа обновляется не чаще раза в этот интервал
+TOUCH_INTERVAL = 60 * 60
+# Cache-Control для готовых миниатюр: содержимое по ссылке не меняется
+THUMBNAIL_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class FetchError(Exception):
+    pass
+
+
+def is_public_address(address):
+    # Адрес в интернете: не loopback, не частная сеть, не link-local (169.254.169.254) и т.п.
+    ip = ipaddress.ip_address(address.split('%')[0])
+    return ip.is_global and not ip.is_multicast
+
+
+def public_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None, *args, **kwargs):
+    # Замена socket.create_connection: имя разрешается один раз, и соединение идёт
+    # только на проверенные адреса (подмена DNS между проверкой и подключением не помогает)
+    host, port = address
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except OSError as exc:
+        raise FetchError(str(exc)) from exc
+    addresses = [info[4][0] for info in infos]
+    refused = [item for item in addresses if not is_public_address(item)]
+    if refused:
+        raise FetchError('Address is not public: %s (%s)' % (host, refused[0]))
+    error = None
+    for item in addresses:
+        try:
+            return socket.create_connection((item, port), timeout, source_address)
+        except OSError as exc:
+            error = exc
+    raise error
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = public_connection
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = public_connection
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+class PublicRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # Перенаправления - только на http(s): ftp и file обошли бы проверку адресов.
+    # Адрес каждого перехода проверяется при подключении (public_connection)
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if urlparse(newurl).scheme not in ('http', 'https'):
+            raise FetchError('Unsupported redirect: %s' % newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def public_opener():
+    # Без прокси из окружения: иначе подключение шло бы к прокси, а не к проверенному адресу
+    return urllib.request.build_opener(
+        urllib.request.ProxyHandler({}), PublicHTTPHandler, PublicHTTPSHandler, PublicRedirectHandler,
+    )
+
+
+class HTTPFetcher:
+    # Загрузка по http(s) с ограничением размера и времени. image_url задаёт пользователь,
+    # поэтому запросы во внутреннюю сеть (loopback, частные и link-local адреса)
+    # запрещены, в том числе после перенаправлений
+    def __init__(self, timeout=10, max_bytes=10 * 1024 * 1024):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.opener = public_opener()
+
+    def fetch(self, url):
+        if urlparse(url).scheme not in ('http', 'https'):
+            raise FetchError('Unsupported URL: %s' % url)
+        request = urllib.request.Request(url, headers={'User-Agent': 'barter-system-thumbnails'})
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                data = response.read(self.max_bytes + 1)
+        except OSError as exc:
+            raise FetchError(str(exc)) from exc
+        if len(data) > self.max_bytes:
+            raise FetchError('Image is larger than %d bytes' % self.max_bytes)
+        return data
+
+
+class LocalFileFetcher:
+    # Путь URL ищется в каталоге root (для тестов и локальной разработки)
+    def __init__(self, root=None):
+        self.root = Path(root or getattr(settings, 'ADS_THUMBNAIL_LOCAL_ROOT', settings.BASE_DIR))
+
+    def fetch(self, url):
+        path = (self.root / urlparse(url).path.lstrip('/')).resolve()
+        if self.root.resolve() not in path.parents:
+            raise FetchError('Path outside of root: %s' % url)
+        try:
+            return path.read_bytes()
+        except OSError as exc:
+            raise FetchError(str(exc)) from exc
+
+
+def thumbnail_options():
+    return {
+        'path': Path(getattr(settings, 'ADS_THUMBNAIL_DIR', Path(settings.BASE_DIR) / 'thumbnails')),
+        'size': tuple(getattr(settings, 'ADS_THUMBNAIL_SIZE', (400, 200))),
+        'max_bytes': getattr(settings, 'ADS_THUMBNAIL_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+    }
+
+
+def get_fetcher():
+    return import_string(getattr(settings, 'ADS_THUMBNAIL_FETCHER', 'ads.thumbnails.HTTPFetcher'))()
+
+
+def make_thumbnail(data, size):
+    # JPEG size[0]×size[1]: картинка масштабируется и обрезается по центру
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            background = Image.new('RGB', image.size, 'white')
+            rgba = image.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            image = background
+        thumbnail = ImageOps.fit(image, size, Image.LANCZOS)
+    output = io.BytesIO()
+    thumbnail.save(output, 'JPEG', quality=85, optimize=True)
+    return output.getvalue()
+
+
+class ThumbnailCache:
+    # data/<xx>/<sha256>.jpg - миниатюры по хэшу содержимого (одинаковые картинки хранятся один раз),
+    # sources/<ключ источника> - хэш миниатюры для URL или пометка о неудачной загрузке
+    def __init__(self, path, size=(400, 200), max_bytes=256 * 1024 * 1024):
+        self.path = Path(path)
+        self.size = size
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._usage = None
+
+    def source_key(self, url):
+        return hashlib.sha256(('%d:%dx%d:%s' % (THUMBNAIL_VERSION, *self.size, url)).encode()).hexdigest()
+
+    def _source_file(self, key):
+        return self.path / 'sources' / key
+
+    def _data_file(self, digest):
+        return self.path / 'data' / digest[:2] / ('%s.jpg' % digest)
+
+    def get(self, url):
+        # (путь к файлу, хэш) готовой миниатюры или None
+        try:
+            digest = self._source_file(self.source_key(url)).read_text()
+        except OSError:
+            return None
+        if not digest or digest == 'failed':
+            return None
+        path = self._data_file(digest)
+        try:
+            accessed = path.stat().st_mtime
+        except OSError:
+            return None
+        if time.time() - accessed > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path, digest
+
+    def failed_recently(self, url, retry_after):
+        try:
+            source = self._source_file(self.source_key(url))
+            return source.read_text() == 'failed' and time.time() - source.stat().st_mtime < retry_after
+        except OSError:
+            return False
+
+    def _write(self, path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name('%s.%d.%d.tmp' % (path.name, os.getpid(), threading.get_ident()))
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def store(self, url, thumbnail):
+        digest = hashlib.sha256(thumbnail).hexdigest()
+        path = self._data_file(digest)
+        with self._lock:
+            if not path.exists():
+                self._write(path, thumbnail)
+                if self._usage is not None:
+                    self._usage += len(thumbnail)
+            else:
+                os.utime(path)
+            self._write(self._source_file(self.source_key(url)), digest.encode())
+            self.evict()
+        return path, digest
+
+    def mark_failed(self, url):
+        self._write(self._source_file(self.source_key(url)), b'failed')
+
+    def _files(self):
+        data = self.path / 'data'
+        if not data.exists():
+            return []
+        return [entry for directory in os.scandir(data) if directory.is_dir()
+                for entry in os.scandir(directory) if entry.name.endswith('.jpg')]
+
+    def usage(self):
+        if self._usage is None:
+            self._usage = sum(entry.stat().st_size for entry in self._files())
+        return self._usage
+
+    def evict(self):
+        # При переполнении удаляются самые давние по доступу файлы, пока кэш не станет 90% от предела
+        if self.usage() <= self.max_bytes:
+            return 0
+        files = sorted(self._files(), key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in files)
+        removed = 0
+        for entry in files:
+            if total <= self.max_bytes * 0.9:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        # Записи sources на удалённые файлы остаются: get() их не найдёт, и миниатюра построится заново
+        self._usage = total
+        return removed
+
+
+class ThumbnailWorker:
+    # Фоновая генерация: пул потоков, один URL обрабатывается одним потоком.
+    # workers=0 - генерация сразу в вызывающем потоке (тесты, команда generate_thumbnails)
+    def __init__(self, cache, workers=2, retry_after=60 * 60):
+        self.cache = cache
+        self.workers = workers
+        self.retry_after = retry_after
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, url):
+        if not url or Image is None or self.cache.get(url) or self.cache.failed_recently(url, self.retry_after):
+            return
+        with self._lock:
+            if url in self._pending:
+                return
+            self._pending.add(url)
+            if self.workers:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='thumbnails')
+                self._executor.submit(self.generate, url)
+                return
+        self.generate(url)
+
+    def generate(self, url):
+        try:
+            data = get_fetcher().fetch(url)
+            self.cache.store(url, make_thumbnail(data, self.cache.size))
+        except (FetchError, OSError, ValueError, Image.DecompressionBombError):
+            # Недоступный источник или не картинка: повтор не раньше чем через retry_after
+            self.cache.mark_failed(url)
+        finally:
+            with self._lock:
+                self._pending.discard(url)
+
+
+_workers = {}
+
+
+def get_worker():
+    options = thumbnail_options()
+    key = tuple(options.values())
+    if key not in _workers:
+        _workers[key] = ThumbnailWorker(
+            ThumbnailCache(**options),
+            workers=getattr(settings, 'ADS_THUMBNAIL_WORKERS', 2),
+            retry_after=getattr(settings, 'ADS_THUMBNAIL_RETRY_AFTER', 60 * 60),
+        )
+    return _workers[key]
+
+
+def thumbnail_url(image_url):
+    # Ссылка на миниатюру; без Pillow - исходная картинка
+    if not image_url or Image is None:
+        return image_url
+    return reverse('thumbnail', kwargs={'token': signing.dumps(image_url, salt=SIGNING_SALT, compress=True)})
+
+
+def source_url(token):
+    # URL источника из ссылки на миниатюру; BadSignature для подделанных ссылок
+    return signing.loads(token, salt=SIGNING_SALT)
+
+
+def schedule_thumbnails(urls):
+    # После фиксации транзакции: миниатюры готовятся заранее, до первого показа
+    urls = {url for url in urls if url}
+    if urls and Image is not None:
+        worker = get_worker()
+        transaction.on_commit(lambda: [worker.schedule(url) for url in sorted(urls)])
@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.urls import path, include
+from .events import events_enabled
 from rest_framework.routers import DefaultRouter
 from .views import *
 from rest_framework import permissions
@@ -8,6 +10,7 @@ from drf_yasg import openapi
 router = DefaultRouter()
 router.register(r'ads', AdViewSet)
 router.register(r'proposals', ExchangeProposalViewSet)
+router.register(r'chains', BarterChainViewSet)
 
 schema_view = yasg_get_schema_view(
     openapi.Info(
@@ -21,21 +24,48 @@ schema_view = yasg_get_schema_view(
     public=True,
     permission_classes=(permissions.AllowAny,),
 )
-urlpatterns = [
 
-    path('docs/', schema_view.with_ui('swagger', cache_timeout=0),
-         name='schema-swagger-ui'),
-    path('create-ad/', create_ad, name='create_ad'),
-    path('update-ad/<int:pk>/', update_ad, name='update_ad'),
-    path('delete-ad/<int:pk>/', delete_ad, name='delete_ad'),
-    path('', ad_list, name='ad_list'),
-    path('ad/<int:pk>/', ad_detail, name='ad_detail'),
-    path('create-exchange-proposal/', create_exchange_proposal, name='create_exchange_proposal'),
-    path('signup/', signup_view, name='signup'),
-    path('login/', login_view, name='login'),
-    path('logout/', logout_view, name='logout'),
 
-    path('proposals/', proposals_list, name='proposals_list'),
-    path('proposals/<int:pk>/update/', update_proposal, name='update_proposal'),
-    path('api/', include(router.urls)),
-]
\ No newline at end of file
+def build_urlpatterns(async_views=False, events=False):
+    # async_views=True подключает асинхронные версии читающих представлений (для ASGI),
+    # events=True - поток уведомлений (держит соединение открытым, только под ASGI)
+    list_view, detail_view, proposals_view = ad_list, ad_detail, proposals_list
+    extra_patterns = []
+    if events:
+        from .async_views import proposal_events
+        extra_patterns.append(path('proposals/events/', proposal_events, name='proposal_events'))
+    if async_views:
+        from . import async_views as views_async
+        list_view, detail_view, proposals_view = (
+            views_async.ad_list, views_async.ad_detail, views_async.proposals_list,
+        )
+        extra_patterns += [
+            path('api/ads/', views_async.ad_api_list, name='ad-list'),
+            path('api/ads/<int:pk>/', views_async.ad_api_detail, name='ad-detail'),
+        ]
+    return [
+
+        path('docs/', schema_view.with_ui('swagger', cache_timeout=0),
+             name='schema-swagger-ui'),
+        path('create-ad/', create_ad, name='create_ad'),
+        path('update-ad/<int:pk>/', update_ad, name='update_ad'),
+        path('delete-ad/<int:pk>/', delete_ad, name='delete_ad'),
+        path('', list_view, name='ad_list'),
+        path('ad/<int:pk>/', detail_view, name='ad_detail'),
+        path('create-exchange-proposal/', create_exchange_proposal, name='create_exchange_proposal'),
+        path('signup/', signup_view, name='signup'),
+        path('login/', login_view, name='login'),
+        path('logout/', logout_view, name='logout'),
+
+        path('proposals/', proposals_view, name='proposals_list'),
+        path('proposals/inbox/', proposals_view, {'box': 'inbox'}, name='proposals_inbox'),
+        path('proposals/outbox/', proposals_view, {'box': 'outbox'}, name='proposals_outbox'),
+        path('proposals/<int:pk>/update/', update_proposal, name='update_proposal'),
+        path('api/export/<str:kind>/', ExportView.as_view(), name='export'),
+        path('thumbnails/<str:token>/', thumbnail, name='thumbnail'),
+        *extra_patterns,
+        path('api/', include(router.urls)),
+    ]
+
+
+urlpatterns = build_urlpatterns(getattr(settings, 'ADS_ASYNC_VIEWS', False), events_enabled())
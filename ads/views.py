@@ -1,26 +1,211 @@
 from rest_framework import viewsets
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.views import APIView
 from django.http import HttpResponseForbidden
+from .batch import AdBatchCreate, AdBatchDelete, AdBatchUpdate, BatchError, ProposalBatchStatus
+from .bulk_import import FORMATS as IMPORT_FORMATS, AdImporter, detect_format
+from .conditional import ads_stamp, list_etag, not_modified, object_etag, row_etag, set_validators
+from .export import (
+    CONTENT_TYPES as EXPORT_CONTENT_TYPES, EXPORTS, FORMATS as EXPORT_FORMATS, export_stream, parse_since,
+)
+from .fast_serializers import AD_PLAN, PROPOSAL_PLAN, FastJSONRenderer
 from .forms import AdForm, ExchangeProposalForm, LoginForm, SignUpForm
-from .models import Ad, ExchangeProposal
-from .serializers import AdSerializer, ExchangeProposalSerializer
+from .jobs import defer
+from .matching import chain_proposals
+from .models import Ad, AdFacet, BarterChain, BarterChainMember, ExchangeProposal, ProposalCounter
+from .pagination import InvalidCursor, KeysetPagination, KeysetPaginator
+from .proposals import TransitionError, change_status
+from .search import search_ads
+from .serializers import AdSerializer, BarterChainSerializer, ExchangeProposalSerializer, parse_fields
+from .similar import get_index, similar_ads
+from .sqlite import LockRetryMixin, retry_on_lock, retry_writes_on_lock
+from .thumbnails import THUMBNAIL_MAX_AGE, get_worker, source_url
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import login, authenticate, logout
+from django.contrib.auth import login, logout
 from django.core.paginator import Paginator
-from django.db.models import Q
+from django.db.models import Prefetch, Q
 from django.contrib import messages
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import NON_FIELD_ERRORS
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.urls import NoReverseMatch, reverse
+from django.utils.http import urlencode
+
+# Варианты сортировки списка объявлений
+SORT_OPTIONS = [
+    ('-created_at', 'Сначала новые'),
+    ('created_at', 'Сначала старые'),
+    ('title', 'По названию А-Я'),
+    ('-title', 'По названию Я-А'),
+    ('-received_count', 'Больше предложений'),
+]
+
+
+def order_ads(ads, sort_by, search_query=''):
+    # Сортировка по выбранному полю; при поиске по умолчанию - по релевантности
+    if sort_by in dict(SORT_OPTIONS):
+        return ads.order_by(sort_by)
+    if search_query:
+        return ads.order_by('search_rank', '-created_at')
+    return ads.order_by('-created_at')
+
+
+def filter_ads(params):
+    # Поиск и фильтры, общие для ad_list и API
+    ads = Ad.objects.all()
+    search_query = params.get('search', '')
+    if search_query:
+        # Поиск через полнотекстовый индекс вместо icontains по всей таблице
+        ads = search_ads(ads, search_query)
+    if params.get('category'):
+        ads = ads.filter(category=params['category'])
+    if params.get('condition'):
+        ads = ads.filter(condition=params['condition'])
+    return ads
+
+
+def api_ads_queryset(params):
+    # Список объявлений для API (используется и асинхронной версией)
+    return order_ads(filter_ads(params), params.get('sort', ''), params.get('search', ''))
+
+
+def ordering_columns(queryset):
+    # Поля сортировки и id: нужны KeysetPaginator для курсора
+    return ['id', *[name.lstrip('-') for name in queryset.query.order_by]]
+
+
+def user_proposals(user, box='all', status=''):
+    # Входящие (получатель - пользователь), исходящие или все предложения пользователя;
+    # фильтры по sender_user/receiver_user идут по индексам proposal_inbox*/proposal_outbox*
+    if box == 'inbox':
+        proposals = ExchangeProposal.objects.filter(receiver_user=user)
+    elif box == 'outbox':
+        proposals = ExchangeProposal.objects.filter(sender_user=user)
+    else:
+        proposals = ExchangeProposal.objects.filter(Q(receiver_user=user) | Q(sender_user=user))
+    if status:
+        proposals = proposals.filter(status=status)
+    return proposals.select_related('ad_sender', 'ad_receiver').order_by('-created_at')
+
+
+class ProposalListQuery:
+    # Разбор параметров списка предложений, общий для синхронного и асинхронного proposals_list
+    per_page = 20
+    boxes = [('all', 'Все'), ('inbox', 'Входящие'), ('outbox', 'Исходящие')]
+
+    def __init__(self, user, box, params):
+        self.box = box
+        self.status = params.get('status', '')
+        if self.status not in dict(ExchangeProposal.STATUS_CHOICES):
+            self.status = ''
+        self.cursor = params.get('cursor') or None
+        self.paginator = KeysetPaginator(user_proposals(user, box, self.status), self.per_page)
+
+    def context(self, page, counts):
+        # Счётчики из ProposalCounter: для «Все» - сумма входящих и исходящих
+        counts = dict(counts, all={
+            key: counts['inbox'][key] + counts['outbox'][key] for key in counts['inbox']
+        })
+        box_counts = counts[self.box]
+        return {
+            'proposals': page,
+            'box': self.box,
+            'status': self.status,
+            'boxes': [(box, label, counts[box]['total']) for box, label in self.boxes],
+            'statuses': [(value, label, box_counts[value]) for value, label in ExchangeProposal.STATUS_CHOICES],
+            'status_labels': dict(ExchangeProposal.STATUS_CHOICES),
+            'total': box_counts['total'],
+            'next_query': self.query(page.next_cursor),
+            'previous_query': self.query(page.previous_cursor),
+            'events_url': events_url(),
+        }
+
+    def query(self, cursor):
+        if cursor is None:
+            return None
+        return urlencode({key: value for key, value in (('status', self.status), ('cursor', cursor)) if value})
+
+
+def events_url():
+    # Адрес потока уведомлений, если он подключён (ADS_EVENTS_ENABLED), иначе None
+    try:
+        return reverse('proposal_events')
+    except NoReverseMatch:
+        return None
+
+
+def parse_status(value):
+    # ?status= для API: пусто - все статусы
+    if value and value not in dict(ExchangeProposal.STATUS_CHOICES):
+        raise ValidationError({'status': ['"%s" is not a valid choice.' % value]})
+    return value or ''
+
+
+def batch_response(batch_class, request, success_status=status.HTTP_200_OK):
+    # Тело запроса - список элементов; результат по каждому в том же порядке
+    try:
+        batch = batch_class(request.user, request.data)
+    except BatchError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    if not batch.run():
+        # Недопустимая смена статуса - конфликт с текущим состоянием, остальные ошибки - 400
+        conflict = any(result['status'] == 'conflict' for result in batch.results)
+        return Response({"results": batch.results},
+                        status=status.HTTP_409_CONFLICT if conflict else status.HTTP_400_BAD_REQUEST)
+    return Response({"results": batch.results}, status=success_status)
+
+
 # Представление для работы с объявлениями
-class AdViewSet(viewsets.ModelViewSet):
+class AdViewSet(LockRetryMixin, viewsets.ModelViewSet):
     queryset = Ad.objects.all()
     serializer_class = AdSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = api_ads_queryset(self.request.query_params)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        etag = list_etag(request, ads_stamp(), request.accepted_media_type)
+        response = not_modified(request, etag)
+        if response is None:
+            # Чтение через values() и план полей вместо AdSerializer (ответ тот же)
+            plan = AD_PLAN.subset(self.get_sparse_fields())
+            queryset = self.filter_queryset(self.get_queryset())
+            page = self.paginate_queryset(plan.values(queryset, ordering_columns(queryset)))
+            response = self.get_paginated_response(plan.rows(page))
+        return set_validators(response, etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        plan = AD_PLAN.subset(self.get_sparse_fields())
+        row = get_object_or_404(plan.values(self.get_queryset(), ['id', 'updated_at']), pk=kwargs['pk'])
+        etag = row_etag(request, Ad, row['id'], row['updated_at'], request.accepted_media_type)
+        response = not_modified(request, etag, row['updated_at'])
+        if response is None:
+            response = Response(plan.row(row))
+        return set_validators(response, etag, row['updated_at'])
+
+    def get_sparse_fields(self):
+        # ?fields=id,title для чтения: только эти колонки в SELECT и в ответе
+        return parse_fields(self.request.query_params.get('fields'), AdSerializer.Meta.fields)
 
     def perform_create(self, serializer):
-        # Устанавливаем пользователя, создающего объявление
-        serializer.save(user=self.request.user)
+        # Устанавливаем пользователя, создающего объявление; сохраняет LockRetryMixin
+        # (повтор при блокировке базы), serializer.save() добавит user из validated_data
+        serializer.validated_data['user'] = self.request.user
+        super().perform_create(serializer)
 
     def update(self, request, *args, **kwargs):
         # Проверяем, что только автор может редактировать объявление
@@ -36,101 +221,334 @@ class AdViewSet(viewsets.ModelViewSet):
             return Response({"detail": "You can only delete your own ads."}, status=status.HTTP_403_FORBIDDEN)
         return super().destroy(request, *args, **kwargs)
 
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        # Массовая загрузка: тело запроса - NDJSON или CSV, читается потоком
+        fmt = request.query_params.get('input_format') or detect_format(request.content_type)
+        if fmt not in IMPORT_FORMATS:
+            return Response({"detail": "Use Content-Type application/x-ndjson or text/csv."},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        try:
+            batch_size = int(request.query_params.get('batch_size', 0)) or None
+        except ValueError:
+            return Response({"detail": "batch_size must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        report = AdImporter(request.user, batch_size).run(request.stream or [], fmt)
+        if report.created:
+            response_status = status.HTTP_201_CREATED
+        elif report.errors:
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_200_OK
+        return Response(report.as_dict(), status=response_status)
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        # Похожие объявления из предвычисленного индекса: k строк по первичному ключу
+        if not Ad.objects.filter(pk=pk).exists():
+            raise Http404('No Ad matches the given query.')
+        plan = AD_PLAN.subset(self.get_sparse_fields())
+        ranked = get_index().lookup(int(pk))
+        rows = {row['id']: row for row in plan.values(Ad.objects.filter(pk__in=[i for i, _ in ranked]), ['id'])}
+        return Response([
+            dict(plan.row(rows[neighbor]), score=round(score, 4)) for neighbor, score in ranked if neighbor in rows
+        ])
+
+    @action(detail=False, methods=['post', 'patch', 'delete'], url_path='batch')
+    def batch(self, request):
+        # POST - создание, PATCH - частичное изменение ({"id": ..., поля}), DELETE - удаление по id
+        if request.method == 'POST':
+            return batch_response(AdBatchCreate, request, status.HTTP_201_CREATED)
+        if request.method == 'PATCH':
+            return batch_response(AdBatchUpdate, request)
+        return batch_response(AdBatchDelete, request)
+
 # Представление для работы с предложениями обмена
-class ExchangeProposalViewSet(viewsets.ModelViewSet):
+class ExchangeProposalViewSet(LockRetryMixin, viewsets.ModelViewSet):
     queryset = ExchangeProposal.objects.all()
     serializer_class = ExchangeProposalSerializer
     permission_classes = [IsAuthenticated]
-
-    def perform_create(self, serializer):
-        # Устанавливаем отправителя предложения
-        ad_sender = serializer.validated_data['ad_sender']
-        serializer.save()
-
+    pagination_class = KeysetPagination
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get_queryset(self):
+        # Пользователь видит только предложения со своими объявлениями, администратор - все
+        user = self.request.user
+        if self.action in ('inbox', 'outbox'):
+            return user_proposals(user, self.action, parse_status(self.request.query_params.get('status')))
+        queryset = super().get_queryset()
+        if not user.is_staff:
+            queryset = queryset.filter(Q(receiver_user=user) | Q(sender_user=user))
+        if self.action == 'list':
+            status_filter = parse_status(self.request.query_params.get('status'))
+            if status_filter:
+                queryset = queryset.filter(status=status_filter)
+            queryset = queryset.order_by('-created_at')
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        page = self.paginate_queryset(PROPOSAL_PLAN.values(queryset, ordering_columns(queryset)))
+        return self.get_paginated_response(PROPOSAL_PLAN.rows(page))
+
+    @action(detail=False, methods=['get'])
+    def inbox(self, request):
+        # Входящие: предложения к объявлениям пользователя, ?status= для фильтра
+        return self.list(request)
+
+    @action(detail=False, methods=['get'])
+    def outbox(self, request):
+        return self.list(request)
+
+    @action(detail=False, methods=['get'])
+    def counters(self, request):
+        # Число предложений по статусам без COUNT по таблице предложений
+        return Response(ProposalCounter.objects.counts(request.user))
+
+    @retry_on_lock
     def update(self, request, *args, **kwargs):
-        # Только администратор или инициатор предложения может изменять статус
+        # Поля предложения правит отправитель, статус меняет владелец объявления-получателя
+        # (как на сайте); администратор - всё. Одна транзакция: если остальные поля
+        # не прошли проверку, статус тоже не меняется
         proposal = self.get_object()
-        if proposal.ad_sender != request.user and not request.user.is_staff:
+        user = request.user
+        if user.pk not in (proposal.sender_user_id, proposal.receiver_user_id) and not user.is_staff:
             return Response({"detail": "You do not have permission to update this proposal."}, status=status.HTTP_403_FORBIDDEN)
+        new_status = request.data.get('status')
+        if new_status is not None and new_status != proposal.status and proposal.receiver_user_id != user.pk and not user.is_staff:
+            return Response({"detail": "Only the receiver can change the proposal status."}, status=status.HTTP_403_FORBIDDEN)
+        if new_status in dict(ExchangeProposal.STATUS_CHOICES):
+            # Смена статуса - через переходы ads.proposals, остальные поля - обычным сохранением
+            try:
+                change_status(proposal.pk, new_status)
+            except TransitionError as exc:
+                return Response({'status': [str(exc)]}, status=status.HTTP_409_CONFLICT)
         return super().update(request, *args, **kwargs)
 
+    @action(detail=False, methods=['patch'], url_path='batch')
+    def batch(self, request):
+        # Смена статусов: [{"id": ..., "status": ...}, ...]
+        return batch_response(ProposalBatchStatus, request)
+
+    def retrieve(self, request, *args, **kwargs):
+        row = get_object_or_404(PROPOSAL_PLAN.values(self.get_queryset()), pk=kwargs['pk'])
+        etag = row_etag(request, ExchangeProposal, row['id'], row['updated_at'], request.accepted_media_type)
+        response = not_modified(request, etag, row['updated_at'])
+        if response is None:
+            response = Response(PROPOSAL_PLAN.row(row))
+        return set_validators(response, etag, row['updated_at'])
+
+# Предложенные цепочки обмена с участием пользователя
+class BarterChainViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = BarterChain.objects.all()
+    serializer_class = BarterChainSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return BarterChain.objects.filter(members__user=self.request.user).prefetch_related(
+            Prefetch('members', queryset=BarterChainMember.objects.order_by('position')),
+        ).order_by('-created_at')
+
+    def chain_response(self, chains, many=True):
+        context = dict(self.get_serializer_context(), proposals=chain_proposals(chains))
+        return self.get_serializer(chains if many else chains[0], many=many, context=context).data
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(self.chain_response(page))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.chain_response([self.get_object()], many=False))
+
+class AdListQuery:
+    # Разбор параметров списка объявлений, общий для синхронного и асинхронного ad_list
+    per_page = 10
+
+    def __init__(self, params):
+        self.search_query = params.get('search', '')
+        self.category = params.get('category', '')
+        self.condition = params.get('condition', '')
+        self.raw_sort = params.get('sort', '')
+        self.cursor = params.get('cursor') or None
+        self.page_number = params.get('page')
+        # Курсорный режим: ?cursor=... или ADS_LIST_PAGINATION = 'cursor'
+        self.cursor_mode = 'cursor' in params or getattr(settings, 'ADS_LIST_PAGINATION', 'page') == 'cursor'
+
+        ads = filter_ads(params)
+
+        # Добавляем варианты сортировки
+        self.sort_options = list(SORT_OPTIONS)
+        if self.search_query:
+            self.sort_options.insert(0, ('relevance', 'По релевантности'))
+        self.sort_by = self.raw_sort
+        if self.sort_by not in dict(self.sort_options):
+            self.sort_by = 'relevance' if self.search_query else '-created_at'
+        self.ads = order_ads(ads, self.sort_by, self.search_query)
+
+    def keyset_paginator(self):
+        return KeysetPaginator(self.ads, self.per_page)
+
+    def paginator(self):
+        return Paginator(self.ads, self.per_page)
+
+    def context(self, page_obj, categories, condition_counts):
+        page_range = None
+        if not self.cursor_mode:
+            # Сокращённый список номеров страниц вместо всего page_range
+            page_range = page_obj.paginator.get_elided_page_range(page_obj.number)
+
+        conditions = [
+            (value, label, condition_counts.get(value, 0))
+            for value, label in Ad._meta.get_field('condition').choices
+        ]
+
+        # Параметры фильтрации для ссылок пагинации
+        filter_params = {
+            'search': self.search_query, 'category': self.category,
+            'condition': self.condition, 'sort': self.raw_sort,
+        }
+        query_string = urlencode({key: value for key, value in filter_params.items() if value})
+
+        return {
+            'page_obj': page_obj,
+            'cursor_mode': self.cursor_mode,
+            'page_range': page_range,
+            'query_string': '&' + query_string if query_string else '',
+            'categories': categories,
+            'conditions': conditions,
+            'sort_options': self.sort_options,
+            # Сохраняем параметры фильтрации для формы
+            'search_query': self.search_query,
+            'selected_category': self.category,
+            'selected_condition': self.condition,
+            'selected_sort': self.sort_by,
+        }
+
+
 def ad_list(request):
-    search_query = request.GET.get('search', '')
-    category = request.GET.get('category', '')
-    condition = request.GET.get('condition', '')
-    sort_by = request.GET.get('sort', '-created_at')
-    ads = Ad.objects.all().order_by('-created_at')
-    if search_query:
-        ads = ads.filter(Q(title__icontains=search_query) | Q(description__icontains=search_query))
-
-    if category:
-        ads = ads.filter(category=category)
-
-    if condition:
-        ads = ads.filter(condition=condition)
-    ads = ads.order_by(sort_by)
-    paginator = Paginator(ads, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-
-    categories = Ad.objects.values_list('category', flat=True).distinct()
-    conditions = Ad._meta.get_field('condition').choices
-
-    # Добавляем варианты сортировки
-    sort_options = [
-        ('-created_at', 'Сначала новые'),
-        ('created_at', 'Сначала старые'),
-        ('title', 'По названию А-Я'),
-        ('-title', 'По названию Я-А'),
-    ]
-
-    context = {
-        'page_obj': page_obj,
-        'categories': categories,
-        'conditions': conditions,
-        'sort_options': sort_options,
-        # Сохраняем параметры фильтрации для формы
-        'search_query': search_query,
-        'selected_category': category,
-        'selected_condition': condition,
-        'selected_sort': sort_by,
-    }
-
-    return render(request, 'ads/ad_list.html', context)
+    query = AdListQuery(request.GET)
+    etag = list_etag(request, ads_stamp(), query.cursor_mode)
+    response = not_modified(request, etag)
+    if response is not None:
+        return set_validators(response, etag)
+
+    if query.cursor_mode:
+        try:
+            page_obj = query.keyset_paginator().get_page(query.cursor)
+        except InvalidCursor:
+            raise Http404('Неверный курсор')
+    else:
+        page_obj = query.paginator().get_page(query.page_number)
+
+    # Фасеты из материализованной таблицы: O(категорий), а не O(объявлений)
+    categories = AdFacet.objects.category_counts(query.condition)
+    condition_counts = AdFacet.objects.condition_counts(query.category)
+
+    response = render(request, 'ads/ad_list.html', query.context(page_obj, categories, condition_counts))
+    return set_validators(response, etag)
+
+class ExportView(APIView):
+    # Потоковая выгрузка для аналитики: /api/export/ads/?output=csv&gzip=1&since=...&since_id=...
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, kind):
+        if kind not in EXPORTS:
+            raise Http404('Unknown export')
+        params = request.query_params
+        fmt = params.get('output', 'ndjson')
+        if fmt not in EXPORT_FORMATS:
+            return Response({"detail": "output must be ndjson or csv."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            since = parse_since(params['since']) if params.get('since') else None
+            since_id = int(params['since_id']) if params.get('since_id') else None
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        compress = params.get('gzip') in ('1', 'true')
+
+        filename = '%s.%s' % (kind, fmt)
+        if compress:
+            filename += '.gz'
+        response = StreamingHttpResponse(
+            export_stream(kind, fmt, compress, since, since_id),
+            content_type='application/gzip' if compress else EXPORT_CONTENT_TYPES[fmt],
+        )
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
+
+
+def thumbnail(request, token):
+    # Миниатюра image_url из дискового кэша; пока её нет - генерация в фоне и переход на оригинал
+    try:
+        url = source_url(token)
+    except signing.BadSignature:
+        raise Http404('Invalid thumbnail link')
+    worker = get_worker()
+    found = worker.cache.get(url)
+    if found is None:
+        worker.schedule(url)
+        found = worker.cache.get(url)
+    try:
+        stream = open(found[0], 'rb') if found else None
+    except OSError:
+        # Файл успели вытеснить из кэша
+        stream = None
+    if stream is None:
+        response = redirect(url)
+        patch_cache_control(response, no_cache=True)
+        return response
+    etag = quote_etag(found[1])
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = FileResponse(stream, content_type='image/jpeg')
+    else:
+        stream.close()
+    response.headers['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=THUMBNAIL_MAX_AGE, immutable=True)
+    return response
+
 
 def logout_view(request):
     logout(request)
     return redirect('ad_list')
 @login_required
+@retry_writes_on_lock
 def update_proposal(request, pk):
     proposal = get_object_or_404(ExchangeProposal, pk=pk)
 
-    if proposal.ad_receiver.user != request.user:
+    if proposal.receiver_user_id != request.user.pk:
         messages.error(request, "Вы не можете изменять это предложение")
         return redirect('proposals_list')
 
     if request.method == 'POST':
         new_status = request.POST.get('status')
         if new_status in dict(ExchangeProposal.STATUS_CHOICES):
-            proposal.status = new_status
-            proposal.save()
-            messages.success(request, "Статус предложения обновлен")
+            try:
+                result = change_status(proposal.pk, new_status)
+            except TransitionError as exc:
+                messages.error(request, str(exc))
+            else:
+                messages.success(request, "Статус предложения обновлен")
+                if result.rejected:
+                    messages.info(request, "Другие предложения с этими объявлениями отклонены: %d" % len(result.rejected))
 
     return redirect('proposals_list')
 
 
-def proposals_list(request):
+def proposals_list(request, box='all'):
     if not request.user.is_authenticated:
         return redirect('login')
 
-    proposals = ExchangeProposal.objects.filter(
-        Q(ad_sender__user=request.user) | Q(ad_receiver__user=request.user)
-    ).select_related('ad_sender', 'ad_receiver')
+    query = ProposalListQuery(request.user, box, request.GET)
+    try:
+        page = query.paginator.get_page(query.cursor)
+    except InvalidCursor:
+        raise Http404('Invalid cursor')
 
-    return render(request, 'ads/proposals_list.html', {'proposals': proposals})
+    return render(request, 'ads/proposals_list.html', query.context(page, ProposalCounter.objects.counts(request.user)))
 
 
 @login_required
+@retry_writes_on_lock
 def create_ad(request):
     if request.method == 'POST':
         form = AdForm(request.POST, initial={'user': request.user})  # Добавьте initial
@@ -144,6 +562,7 @@ def create_ad(request):
     return render(request, 'ads/create_ad.html', {'form': form})
 
 @login_required
+@retry_writes_on_lock
 def update_ad(request, pk):
     ad = get_object_or_404(Ad, pk=pk)
     if ad.user != request.user:
@@ -159,19 +578,33 @@ def update_ad(request, pk):
 
 # views.py (исправление delete_ad)
 @login_required
+@retry_writes_on_lock
 def delete_ad(request, pk):
     ad = get_object_or_404(Ad, pk=pk)
     if ad.user != request.user:
         return HttpResponseForbidden("У вас нет прав удалить это объявление.")  # Возвращаем 403
-    ad.delete()
+    # Каскадное удаление предложений - фоновой задачей, если очередь включена.
+    # created_at в ключе: SQLite может повторно выдать id удалённого объявления
+    key = 'delete-ad:%d:%d' % (ad.pk, ad.created_at.timestamp() * 1000000)
+    if defer('ads.tasks.delete_ad', ad.pk, key=key):
+        messages.info(request, "Объявление будет удалено в течение нескольких секунд")
     return redirect('ad_list')
 
 def ad_detail(request, pk):
-    ad = get_object_or_404(Ad, pk=pk)
-    return render(request, 'ads/ad_detail.html', {'ad': ad})
+    # Счётчик объявлений автора - в том же запросе
+    ad = get_object_or_404(Ad.objects.select_related('user__ad_counter'), pk=pk)
+    # Похожие объявления - строка индекса на диске; их id входят в ETag.
+    # Число объявлений автора меняется без изменения этого объявления - тоже часть ETag
+    similar = get_index().lookup(ad.pk)
+    etag = object_etag(request, ad, similar, ad.author_ad_count)
+    response = not_modified(request, etag, ad.updated_at)
+    if response is None:
+        response = render(request, 'ads/ad_detail.html', {'ad': ad, 'similar_ads': similar_ads(similar)})
+    return set_validators(response, etag, ad.updated_at)
 
 
 @login_required
+@retry_writes_on_lock
 def create_exchange_proposal(request):
     user_ads = Ad.objects.filter(user=request.user)  # Все объявления пользователя
     available_ads = Ad.objects.exclude(user=request.user)  # Объявления других пользователей для обмена
@@ -191,7 +624,7 @@ def create_exchange_proposal(request):
             ad_sender=ad_sender,
             ad_receiver=ad_receiver,
             comment=comment,
-            status='ожидает',  # начальный статус
+            status='pending',  # начальный статус
         )
         proposal.save()  # Сохраняем предложение обмена
 
@@ -201,6 +634,7 @@ def create_exchange_proposal(request):
         'user_ads': user_ads,  # Объявления пользователя
         'available_ads': available_ads,  # Объявления других пользователей
     })
+@retry_writes_on_lock
 def signup_view(request):
     if request.method == 'POST':
         form = SignUpForm(request.POST)
@@ -214,17 +648,13 @@ def signup_view(request):
 
 
 def login_view(request):
-    form = LoginForm(data=request.POST or None)
-
-    if request.method == 'POST':
-        if form.is_valid():
-            username = form.cleaned_data['username']
-            password = form.cleaned_data['password']
-            user = authenticate(username=username, password=password)
+    form = LoginForm(request, data=request.POST or None)
 
-            if user is not None:
-                login(request, user)
-                # Перенаправляем на главную страницу через имя URL-шаблона
-                return redirect('ad_list')  # Используем имя URL, а не имя шаблона
+    # Пароль проверяется один раз - в form.is_valid() (AuthenticationForm вызывает authenticate())
+    if request.method == 'POST' and form.is_valid():
+        login(request, form.get_user())
+        # Перенаправляем на главную страницу через имя URL-шаблона
+        return redirect('ad_list')
 
-    return render(request, 'registration/login.html', {'form': form})
\ No newline at end of file
+    status_code = 429 if form.has_error(NON_FIELD_ERRORS, 'throttled') else 200
+    return render(request, 'registration/login.html', {'form': form}, status=status_code)
@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The proposal event stream (/proposals/events/) keeps connections open and
+needs this entry point, e.g. ``uvicorn barter_system.asgi:application``.
 """
 
 import os
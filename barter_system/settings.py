@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ads.query_stats.QueryStatsMiddleware',
+    'ads.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,6 +87,37 @@ DATABASES = {
     }
 }
 
+# Продакшен-профиль SQLite (ADS_SQLITE_PRODUCTION=1 в окружении): прагмы ADS_SQLITE_PRAGMAS
+# при открытии соединения (ads/sqlite.py), постоянные соединения и BEGIN IMMEDIATE
+ADS_SQLITE_PRODUCTION = os.environ.get('ADS_SQLITE_PRODUCTION') == '1'
+ADS_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # КиБ
+    'busy_timeout': 5000,  # мс
+}
+# Повторы пишущих запросов, если блокировку не дали за busy_timeout; начальная задержка (с)
+ADS_SQLITE_LOCK_RETRIES = 3
+ADS_SQLITE_LOCK_RETRY_DELAY = 0.05
+if ADS_SQLITE_PRODUCTION:
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 5},
+    })
+
+# Реплики для чтения (ads/replicas.py): ADS_SQLITE_REPLICAS=N в окружении добавляет N копий
+# основной базы, которые обновляет manage.py sync_replicas. В тестах реплика - та же база (MIRROR)
+for number in range(1, int(os.environ.get('ADS_SQLITE_REPLICAS', 0)) + 1):
+    DATABASES['replica%d' % number] = dict(
+        DATABASES['default'], NAME=BASE_DIR / ('db.replica%d.sqlite3' % number), TEST={'MIRROR': 'default'},
+    )
+DATABASE_ROUTERS = ['ads.replicas.ReplicaRouter']
+ADS_DB_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+# Сколько секунд после записи пользователь читает только из основной базы
+ADS_DB_PIN_SECONDS = 15
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -102,6 +136,19 @@ AUTH_PASSWORD_VALIDATORS = [
         'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
     },
 ]
+
+# Первый хэшер - для новых паролей; хэши остальных алгоритмов проверяются
+# и при входе пересчитываются первым (например, для перехода на Argon2 его ставят первым)
+PASSWORD_HASHERS = [
+    'ads.auth.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+# Проверка пароля с ограничением неудачных попыток (ads/auth.py)
+AUTHENTICATION_BACKENDS = ['ads.auth.ThrottledModelBackend']
+
 LOGIN_REDIRECT_URL = 'ad_list'
 LOGOUT_REDIRECT_URL = 'ad_list'
 
@@ -128,3 +175,59 @@ LOGOUT_REDIRECT_URL = 'ad_list'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Настройки приложения ads
+# Пагинация списка объявлений по умолчанию: 'page' (номера страниц) или 'cursor'
+ADS_LIST_PAGINATION = 'page'
+# Асинхронные версии ad_list, ad_detail, proposals_list и чтения /api/ads/ (для ASGI)
+ADS_ASYNC_VIEWS = False
+# Размер пачки bulk_create при массовом импорте объявлений
+ADS_IMPORT_BATCH_SIZE = 500
+# Размер порции чтения из базы при потоковой выгрузке
+ADS_EXPORT_CHUNK_SIZE = 2000
+# Заголовки X-DB-Queries и X-DB-Time в ответах (по умолчанию - при DEBUG)
+ADS_QUERY_STATS_HEADERS = DEBUG
+# Максимальное число элементов в пакетных запросах /api/ads/batch/ и /api/proposals/batch/
+ADS_BATCH_MAX_SIZE = 100
+# Цепочки обмена: максимальная длина цикла, предел обхода графа и число цепочек на новое ребро
+ADS_CHAIN_MAX_LENGTH = 4
+ADS_CHAIN_MAX_NODES = 10000
+ADS_CHAIN_MAX_RESULTS = 100
+# Похожие объявления: каталог индекса (build_similar_index), число соседей и размерность векторов
+ADS_SIMILAR_DIR = BASE_DIR / 'similar_index'
+ADS_SIMILAR_TOP_K = 10
+ADS_SIMILAR_DIM = 256
+# Изменения объявлений применяются к индексу похожих в фоновом потоке (False - сразу после
+# фиксации транзакции в том же потоке); при ADS_BACKGROUND_JOBS - задачей Job
+ADS_SIMILAR_BACKGROUND_REFRESH = True
+# Миниатюры image_url: каталог кэша, размер, предел кэша в байтах, число фоновых потоков (0 - сразу
+# в запросе), загрузчик источников и пауза перед повторной загрузкой после ошибки (с)
+ADS_THUMBNAIL_DIR = BASE_DIR / 'thumbnails'
+ADS_THUMBNAIL_SIZE = (400, 200)
+ADS_THUMBNAIL_CACHE_MAX_BYTES = 256 * 1024 * 1024
+ADS_THUMBNAIL_WORKERS = 2
+ADS_THUMBNAIL_FETCHER = 'ads.thumbnails.HTTPFetcher'
+ADS_THUMBNAIL_RETRY_AFTER = 60 * 60
+# Фоновые задачи: False - выполняются сразу в запросе, True - ставятся в очередь Job для manage.py run_jobs.
+# Аренда задачи исполнителем (с), число попыток, задержка повтора (с, удваивается до предела)
+# и срок хранения выполненных задач (с)
+ADS_BACKGROUND_JOBS = False
+ADS_JOBS_VISIBILITY_TIMEOUT = 300
+ADS_JOBS_MAX_ATTEMPTS = 5
+ADS_JOBS_BACKOFF_BASE = 5
+ADS_JOBS_BACKOFF_MAX = 60 * 60
+ADS_JOBS_KEEP_DONE = 24 * 60 * 60
+# Уведомления о предложениях (Server-Sent Events, /proposals/events/): брокер событий,
+# интервал пульса и задержка переподключения клиента (с)
+# Поток держит соединение открытым и работает только под ASGI: без ADS_EVENTS_ENABLED
+# маршрут не подключается и страница не подписывается
+ADS_EVENTS_ENABLED = ADS_ASYNC_VIEWS
+ADS_EVENTS_BROKER = 'ads.events.InProcessBroker'
+ADS_EVENTS_HEARTBEAT = 15
+ADS_EVENTS_RETRY = 5
+# Вход: число итераций PBKDF2 (при изменении хэши пересчитываются при входе пользователя)
+# и ограничение неудачных попыток по имени пользователя и по IP за окно (с)
+ADS_PASSWORD_ITERATIONS = 1_000_000
+ADS_LOGIN_MAX_FAILURES = 5
+ADS_LOGIN_MAX_FAILURES_PER_IP = 50
+ADS_LOGIN_FAILURE_WINDOW = 15 * 60